@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Benchmarks of the rp9 handling
+#
+
+import corpus
+
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+from zipfile import ZipFile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.joinpath('rp9unpacker')))
+
+import rp9qt
+import rp9util as util
+from cache import ThumbnailCache
+from config import Config
+from rp9index import Rp9Index
+
+
+class BenchmarkResult:
+    def __init__(self, name, corpus_size, seconds, byte_count=0):
+        self.name = name
+        self.corpus_size = corpus_size
+        self.seconds = seconds
+        self.byte_count = byte_count
+
+    def to_dict(self):
+        return {
+            'benchmark': self.name,
+            'corpus_size': self.corpus_size,
+            'total_seconds': self.seconds,
+            'per_archive_ms': self.seconds * 1000 / self.corpus_size if self.corpus_size > 0 else 0,
+            'bytes': self.byte_count,
+            'mb_per_second': self.byte_count / self.seconds / 1048576 if self.seconds > 0 else 0,
+        }
+
+
+def timed(function, files):
+    started = time.perf_counter()
+    for file in files:
+        function(file)
+    return time.perf_counter() - started
+
+
+def make_config(work_dir):
+    config = Config()
+    config.fsuae_documents_dir = str(work_dir.joinpath('documents'))
+    config.fsuae_rp9_dir = str(work_dir.joinpath('rp9'))
+    config.temp_dir = str(work_dir.joinpath('temp'))
+    config.media_store_dir = ''
+    config.temp_cache_size = 0
+    work_dir.joinpath('documents', 'Configurations').mkdir(parents=True)
+    work_dir.joinpath('rp9').mkdir()
+    work_dir.joinpath('temp').mkdir()
+    return config
+
+
+def run_benchmarks(files, work_dir, threads):
+    results = []
+    count = len(files)
+    media_bytes = 0
+    for file in files:
+        with ZipFile(str(file)) as zipfile:
+            media_bytes = media_bytes + sum(zipinfo.file_size for zipinfo in zipfile.infolist()
+                                            if zipinfo.filename.endswith(('.adf', '.hdf')))
+    config = make_config(work_dir)
+    config.extract_threads = threads
+
+    # manifest parsing, without and with the persistent index
+    util.manifest_index = None
+    util.thumbnail_cache = None
+    results.append(BenchmarkResult('get_info', count, timed(util.get_info, files)))
+
+    util.manifest_index = Rp9Index(work_dir.joinpath('index.db'))
+    results.append(BenchmarkResult('get_info_index_cold', count, timed(util.get_info, files)))
+    results.append(BenchmarkResult('get_info_index_warm', count, timed(util.get_info, files)))
+
+    # extras, without and with the thumbnail cache
+    rp9qt.install()
+    results.append(BenchmarkResult('get_info_extras', count,
+                                   timed(lambda file: util.get_info(file, load_extras=True), files)))
+    util.thumbnail_cache = ThumbnailCache(work_dir.joinpath('thumbnails'))
+    results.append(BenchmarkResult('get_info_extras_thumbnails_cold', count,
+                                   timed(lambda file: util.get_info(file, load_extras=True), files)))
+    results.append(BenchmarkResult('get_info_extras_thumbnails_warm', count,
+                                   timed(lambda file: util.get_info(file, load_extras=True), files)))
+
+    # extraction and configuration
+    results.append(BenchmarkResult('extract', count,
+                                   timed(lambda file: util.extract(file, config), files), media_bytes))
+    # the incremental override only compares the unchanged files, the full one extracts everything again
+    results.append(BenchmarkResult('extract_sync_unchanged', count,
+                                   timed(lambda file: util.extract(file, config, True), files), media_bytes))
+    config.incremental_extract = False
+    results.append(BenchmarkResult('extract_override_full', count,
+                                   timed(lambda file: util.extract(file, config, True), files), media_bytes))
+    results.append(BenchmarkResult('write_config', count,
+                                   timed(lambda file: util.write_config(file, config, True), files)))
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='benchmark.py', description='Benchmarks the rp9 handling.')
+    parser.add_argument('--sizes', default='10,100', help='comma separated corpus sizes (default: 10,100)')
+    parser.add_argument('--threads', type=int, default=1, help='extraction threads (default: 1)')
+    parser.add_argument('--output', default='-', help='file for the json results (default: stdout)')
+    parser.add_argument('--work-dir', default=None, help='directory for the corpus and the extracted files')
+    corpus.add_arguments(parser)
+    args = parser.parse_args(argv[1:])
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    spec = corpus.spec_from_arguments(args)
+    base_dir = Path(tempfile.mkdtemp(prefix='rp9bench_', dir=args.work_dir))
+
+    results = []
+    try:
+        for size in sizes:
+            run_dir = base_dir.joinpath('corpus-' + str(size))
+            files = corpus.generate(run_dir.joinpath('rp9'), size, spec, args.seed)
+            for result in run_benchmarks(files, run_dir.joinpath('work'), args.threads):
+                results.append(result.to_dict())
+                sys.stderr.write(result.name.ljust(34) + str(size).rjust(6) + '  ' +
+                                 '{0:10.3f} ms/archive'.format(results[-1]['per_archive_ms']) + '\n')
+    finally:
+        shutil.rmtree(str(base_dir), ignore_errors=True)
+
+    data = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': vars(spec),
+        'threads': args.threads,
+        'results': results,
+    }
+    if args.output == '-':
+        json.dump(data, sys.stdout, indent=4)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as outfile:
+            json.dump(data, outfile, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
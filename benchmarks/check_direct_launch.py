@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Checks the arguments of the direct launch with a stub FS-UAE command
+#
+
+import corpus
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.joinpath('rp9unpacker')))
+
+import rp9util as util
+from config import Config
+
+STUB = '''#!{0}
+import json, sys
+with open({1!r}, 'w') as record:
+    json.dump(sys.argv[1:], record)
+'''
+
+
+def write_stub(directory):
+    record = directory.joinpath('arguments.json')
+    stub = directory.joinpath('fs-uae')
+    with open(str(stub), 'w') as file:
+        file.write(STUB.format(sys.executable, str(record)))
+    os.chmod(str(stub), 0o755)
+    return stub, record
+
+
+def launch(rp9_file, config, record):
+    if record.exists():
+        record.unlink()
+    process = util.run(rp9_file, config, True)
+    process.execute()
+    with open(str(record)) as file:
+        return process, json.load(file)
+
+
+def check_direct_launch(work_dir, config, record, failures):
+    spec = corpus.CorpusSpec()
+    spec.images = 0
+    spec.floppies = 2
+    rp9_file = work_dir.joinpath('direct.rp9')
+    corpus.write_rp9(rp9_file, 'Direct Title', spec)
+
+    process, arguments = launch(rp9_file, config, record)
+    options = {}
+    for argument in arguments:
+        if not argument.startswith('--') or '=' not in argument:
+            failures.append('not a --key=value argument: ' + argument)
+            continue
+        key, value = argument[2:].split('=', 1)
+        options[key] = value
+
+    # the disk images are read by FS-UAE from inside of the archive
+    archive = os.path.abspath(str(rp9_file))
+    expected = {
+        'floppy_drive_0': os.path.join(archive, 'disk1.adf'),
+        'floppy_drive_1': os.path.join(archive, 'disk2.adf'),
+        'floppy_image_0': os.path.join(archive, 'disk1.adf'),
+        'floppy_image_1': os.path.join(archive, 'disk2.adf'),
+        'floppy_drive_count': '2',
+        'chip_memory': '512',
+        'fast_memory': '1024',
+        'floppy_drive_speed': '800',
+    }
+    for key, value in expected.items():
+        if options.get(key) != value:
+            failures.append('direct launch: ' + key + ' is ' + repr(options.get(key)) + ', expected ' + repr(value))
+    if 'amiga_model' not in options:
+        failures.append('direct launch: amiga_model is missing')
+    if process.config_file is not None or process.remove_dir is not None:
+        failures.append('direct launch: a configuration file was written')
+    if list(Path(config.temp_dir).glob('rp9unpacker_*')):
+        failures.append('direct launch: the media were extracted')
+
+
+def check_extracted_launch(work_dir, config, record, failures):
+    # hard disk images must be writable files, these archives are extracted and started with a configuration
+    spec = corpus.CorpusSpec()
+    spec.images = 0
+    spec.floppies = 1
+    spec.harddrives = 1
+    spec.harddrive_size = 1024 * 1024
+    rp9_file = work_dir.joinpath('harddrive.rp9')
+    corpus.write_rp9(rp9_file, 'Harddrive Title', spec)
+
+    process, arguments = launch(rp9_file, config, record)
+    if process.config_file is None or arguments != [str(process.config_file)]:
+        failures.append('extracted launch: arguments are ' + repr(arguments))
+
+
+def main(argv):
+    work_dir = Path(tempfile.mkdtemp(prefix='rp9check_'))
+    failures = []
+    try:
+        stub, record = write_stub(work_dir)
+        temp_dir = work_dir.joinpath('temp')
+        temp_dir.mkdir()
+
+        config = Config()
+        config.fsuae_command = str(stub)
+        config.temp_dir = str(temp_dir)
+        config.temp_cache_size = 0
+        config.direct_launch = True
+
+        # nothing is written to the home directory
+        util.manifest_index = None
+        util.thumbnail_cache = None
+
+        check_direct_launch(work_dir, config, record, failures)
+        check_extracted_launch(work_dir, config, record, failures)
+    finally:
+        shutil.rmtree(str(work_dir), ignore_errors=True)
+
+    for failure in failures:
+        sys.stderr.write('FAILED: ' + failure + '\n')
+    if failures:
+        return 1
+    sys.stderr.write('direct launch arguments are correct\n')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
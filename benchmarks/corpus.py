@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Generator for synthetic rp9 files
+#
+
+import argparse
+import random
+import struct
+import sys
+import zlib
+
+from pathlib import Path
+from xml.sax.saxutils import escape
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+
+FLOPPY_SIZE = 901120
+
+SYSTEMS = ['a-500', 'a-500plus', 'a-600', 'a-1200', 'a-4000']
+GENRES = ['Action', 'Adventure', 'Puzzle', 'Shoot \'em up', 'Simulation', 'Sports', 'Strategy']
+PUBLISHERS = ['Psygnosis', 'Team17', 'Ocean', 'Thalion', 'Cinemaware']
+
+
+class CorpusSpec:
+    def __init__(self):
+        self.floppies = 2
+        self.floppy_size = FLOPPY_SIZE
+        self.harddrives = 0
+        self.harddrive_size = 8 * 1024 * 1024
+        self.compressed = True
+        self.help_size = 4096
+        self.images = 1
+        self.image_size = 640
+        # part of each media file filled with random data, the rest is zero filled like most disk images
+        self.random_ratio = 0.3
+
+
+def media_data(rnd, size, random_ratio):
+    random_size = int(size * random_ratio)
+    data = rnd.getrandbits(8 * random_size).to_bytes(random_size, 'little') if random_size > 0 else b''
+    return data + bytes(size - random_size)
+
+
+def png_data(rnd, width, height):
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    line = bytes(rnd.getrandbits(8) for i in range(width * 3))
+    raw = b''.join(b'\x00' + line[(y % 7):] + line[:(y % 7)] for y in range(height))
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+        chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b'')
+
+
+def manifest(title, rnd, spec):
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<rp9 xmlns="http://www.retroplatform.com" version="1.2">',
+        '<application>',
+        '<description>',
+        '<title>' + escape(title) + '</title>',
+        '<entity>' + escape(rnd.choice(PUBLISHERS)) + '</entity>',
+        '<type>Game</type>',
+        '<genre>' + escape(rnd.choice(GENRES)) + '</genre>',
+        '<year>' + str(rnd.randint(1985, 1996)) + '</year>',
+        '<language>en</language>',
+        '<rating>' + str(rnd.randint(1, 5)) + '</rating>',
+        '<system-filename>Amiga</system-filename>',
+        '</description>',
+        '<configuration>',
+        '<system>' + rnd.choice(SYSTEMS) + '</system>',
+        '<ram type="chip">524288</ram>',
+        '<ram type="fast">1048576</ram>',
+    ]
+    for i in range(max(1, min(spec.floppies, 4))):
+        lines.append('<peripheral type="dd">floppy</peripheral>')
+    lines.extend([
+        '<compatibility>turbo-floppy</compatibility>',
+        '</configuration>',
+        '<media>',
+    ])
+    for i in range(spec.floppies):
+        lines.append('<floppy priority="' + str(i + 1) + '">disk' + str(i + 1) + '.adf</floppy>')
+    for i in range(spec.harddrives):
+        lines.append('<harddrive priority="' + str(i + 1) + '">hd' + str(i) + '.hdf</harddrive>')
+    lines.extend([
+        '</media>',
+        '<extras>',
+    ])
+    if spec.help_size > 0:
+        lines.append('<document root="embedded" type="help" priority="1">rp9-help-en.txt</document>')
+    for i in range(spec.images):
+        lines.append('<image root="embedded" priority="' + str(i + 1) + '">image' + str(i + 1) + '.png</image>')
+    lines.extend([
+        '</extras>',
+        '</application>',
+        '</rp9>',
+    ])
+    return '\n'.join(lines).encode('utf-8')
+
+
+def write_rp9(path, title, spec, seed=0):
+    rnd = random.Random(seed)
+    compression = ZIP_DEFLATED if spec.compressed else ZIP_STORED
+
+    with ZipFile(str(path), 'w', compression) as zipfile:
+        zipfile.writestr('rp9-manifest.xml', manifest(title, rnd, spec))
+        if spec.help_size > 0:
+            text = ('This is the help text of ' + title + '.\n') * (spec.help_size // 40 + 1)
+            zipfile.writestr('rp9-help-en.txt', text[:spec.help_size])
+        for i in range(spec.images):
+            # png data is already compressed
+            zipinfo = ZipInfo('image' + str(i + 1) + '.png', (1995, 1, 1, 0, 0, 0))
+            zipinfo.compress_type = ZIP_STORED
+            zipfile.writestr(zipinfo, png_data(rnd, spec.image_size, spec.image_size * 3 // 4))
+        for i in range(spec.floppies):
+            zipfile.writestr('disk' + str(i + 1) + '.adf', media_data(rnd, spec.floppy_size, spec.random_ratio))
+        for i in range(spec.harddrives):
+            zipfile.writestr('hd' + str(i) + '.hdf', media_data(rnd, spec.harddrive_size, spec.random_ratio))
+
+
+def generate(directory, count, spec, seed=0):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    files = []
+    for i in range(count):
+        title = 'Synthetic Title ' + str(i + 1).zfill(5)
+        path = directory.joinpath('synthetic-' + str(i + 1).zfill(5) + '.rp9')
+        write_rp9(path, title, spec, seed + i)
+        files.append(path)
+    return files
+
+
+def add_arguments(parser):
+    parser.add_argument('--floppies', type=int, default=2, help='floppy images per archive')
+    parser.add_argument('--floppy-size', type=int, default=FLOPPY_SIZE, help='size of a floppy image in bytes')
+    parser.add_argument('--harddrives', type=int, default=0, help='hard disk images per archive')
+    parser.add_argument('--harddrive-size', type=int, default=8 * 1024 * 1024,
+                        help='size of a hard disk image in bytes')
+    parser.add_argument('--stored', action='store_true', help='store the members without compression')
+    parser.add_argument('--help-size', type=int, default=4096, help='size of the embedded help text in bytes')
+    parser.add_argument('--images', type=int, default=1, help='embedded images per archive')
+    parser.add_argument('--image-size', type=int, default=640, help='width of the embedded images in pixels')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random data')
+
+
+def spec_from_arguments(args):
+    spec = CorpusSpec()
+    spec.floppies = args.floppies
+    spec.floppy_size = args.floppy_size
+    spec.harddrives = args.harddrives
+    spec.harddrive_size = args.harddrive_size
+    spec.compressed = not args.stored
+    spec.help_size = args.help_size
+    spec.images = args.images
+    spec.image_size = args.image_size
+    return spec
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='corpus.py', description='Generates synthetic rp9 files.')
+    parser.add_argument('directory', help='output directory')
+    parser.add_argument('count', type=int, help='number of rp9 files')
+    add_arguments(parser)
+    args = parser.parse_args(argv[1:])
+
+    for path in generate(args.directory, args.count, spec_from_arguments(args), args.seed):
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Headless batch extraction of rp9 libraries
+#
+
+import metrics
+import rp9util as util
+from config import Config
+
+import argparse
+import gettext
+import glob
+import os
+import sys
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+localedir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'locales')
+translate = gettext.translation('batch', localedir, fallback=True)
+_ = translate.gettext
+
+RESULT_EXTRACTED = 'extracted'
+RESULT_SKIPPED = 'skipped'
+RESULT_FAILED = 'failed'
+RESULT_WRITTEN = 'written'
+RESULT_OPTIMIZED = 'optimized'
+
+
+def collect_files(names):
+    files = []
+    seen = set()
+    for name in names:
+        path = Path(name)
+        if path.is_dir():
+            candidates = sorted(p for p in path.rglob('*') if p.name.lower().endswith('.rp9'))
+        else:
+            candidates = sorted(Path(p) for p in glob.glob(name, recursive=True))
+        for candidate in candidates:
+            if candidate.is_file():
+                key = str(candidate.resolve())
+                if key not in seen:
+                    seen.add(key)
+                    files.append(candidate)
+    return files
+
+
+def __extract_one(rp9_file, config, override, skip_existing, metrics_enabled):
+    # the metrics of the worker process are sent back with the result
+    metrics.registry.enabled = metrics_enabled
+    metrics.registry.reset()
+    try:
+        if skip_existing and not override and util.is_already_extracted(rp9_file, config):
+            return rp9_file, RESULT_SKIPPED, None, metrics.registry.snapshot()
+
+        report = util.extract(rp9_file, config, override)
+        message = None
+        if report.modified:
+            message = _('kept modified files: ') + ', '.join(report.modified)
+        return rp9_file, RESULT_EXTRACTED, message, metrics.registry.snapshot()
+
+    except util.Rp9UtilException as ex:
+        return rp9_file, RESULT_FAILED, str(ex), metrics.registry.snapshot()
+
+    except Exception as ex:
+        sys.stderr.write('Could not extract rp9 file: \'' + str(rp9_file) + '\'\n')
+        traceback.print_exc(file=sys.stderr)
+        return rp9_file, RESULT_FAILED, str(ex), metrics.registry.snapshot()
+
+
+def extract_all(files, config, jobs=None, override=False, skip_existing=False):
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(__extract_one, file, config, override, skip_existing, metrics.registry.enabled)
+                   for file in files]
+        for future in futures:
+            rp9_file, result, message, phases = future.result()
+            metrics.registry.merge(phases)
+            results.append((rp9_file, result, message))
+    return results
+
+
+def install_image_codec():
+    # the previews are only scaled down when PyQt5 is available
+    try:
+        import rp9qt
+    except ImportError:
+        return False
+    rp9qt.install()
+    return True
+
+
+def __optimize_one(rp9_file, level, max_preview, metrics_enabled):
+    metrics.registry.enabled = metrics_enabled
+    metrics.registry.reset()
+    try:
+        if max_preview:
+            install_image_codec()
+        old_size, new_size = util.optimize(rp9_file, level, max_preview)
+        message = _('{0} KiB -> {1} KiB').format(old_size // 1024, new_size // 1024)
+        return rp9_file, RESULT_OPTIMIZED, message, metrics.registry.snapshot()
+
+    except util.Rp9UtilException as ex:
+        return rp9_file, RESULT_FAILED, str(ex), metrics.registry.snapshot()
+
+    except Exception as ex:
+        sys.stderr.write('Could not optimize rp9 file: \'' + str(rp9_file) + '\'\n')
+        traceback.print_exc(file=sys.stderr)
+        return rp9_file, RESULT_FAILED, str(ex), metrics.registry.snapshot()
+
+
+def optimize_all(files, jobs=None, level=None, max_preview=util.OPTIMIZE_PREVIEW_SIZE):
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(__optimize_one, file, level, max_preview, metrics.registry.enabled)
+                   for file in files]
+        for future in futures:
+            rp9_file, result, message, phases = future.result()
+            metrics.registry.merge(phases)
+            results.append((rp9_file, result, message))
+    return results
+
+
+def regenerate_all(config, jobs=None):
+    results = []
+    for media_dir, config_file, message in util.regenerate_configs(config, threads=jobs or os.cpu_count() or 1):
+        results.append((media_dir, RESULT_FAILED if config_file is None else RESULT_WRITTEN, message))
+    return results
+
+
+def print_summary(results, out=sys.stdout):
+    labels = {
+        RESULT_EXTRACTED: _('extracted'),
+        RESULT_SKIPPED: _('skipped'),
+        RESULT_FAILED: _('failed'),
+        RESULT_WRITTEN: _('written'),
+        RESULT_OPTIMIZED: _('optimized'),
+    }
+    counts = {RESULT_EXTRACTED: 0, RESULT_SKIPPED: 0, RESULT_FAILED: 0, RESULT_WRITTEN: 0, RESULT_OPTIMIZED: 0}
+
+    width = max(len(label) for label in labels.values())
+    for rp9_file, result, message in results:
+        counts[result] = counts[result] + 1
+        line = labels[result].ljust(width) + '  ' + str(rp9_file)
+        if message is not None:
+            line = line + ': ' + message
+        out.write(line + '\n')
+
+    out.write('\n')
+    if counts[RESULT_WRITTEN] > 0:
+        out.write(_('{0} titles: {1} configurations written, {2} failed').format(
+            len(results), counts[RESULT_WRITTEN], counts[RESULT_FAILED]) + '\n')
+    elif counts[RESULT_OPTIMIZED] > 0:
+        out.write(_('{0} files: {1} optimized, {2} failed').format(
+            len(results), counts[RESULT_OPTIMIZED], counts[RESULT_FAILED]) + '\n')
+    else:
+        out.write(_('{0} files: {1} extracted, {2} skipped, {3} failed').format(
+            len(results), counts[RESULT_EXTRACTED], counts[RESULT_SKIPPED], counts[RESULT_FAILED]) + '\n')
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='batch.py',
+                                     description=_('Extract rp9 files for FS-UAE without the graphical interface.'))
+    parser.add_argument('paths', nargs='*', metavar='PATH',
+                        help=_('rp9 files, directories (searched recursively) or glob patterns'))
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help=_('number of archives extracted in parallel (default: number of CPUs)'))
+    parser.add_argument('--threads', type=int, default=1,
+                        help=_('number of threads extracting the members of one archive (default: 1)'))
+    parser.add_argument('--override', action='store_true',
+                        help=_('override already extracted files'))
+    parser.add_argument('--skip-existing', action='store_true',
+                        help=_('skip rp9 files that are already extracted'))
+    parser.add_argument('--regenerate-configs', action='store_true',
+                        help=_('rewrite the FS-UAE configurations of all extracted titles without extracting them'))
+    parser.add_argument('--optimize', action='store_true',
+                        help=_('rewrite the rp9 files with the manifest and the previews first instead of extracting '
+                               'them'))
+    parser.add_argument('--level', type=int, default=None,
+                        help=_('deflate level (1-9) of the media in optimized files (default: stored uncompressed)'))
+    parser.add_argument('--max-preview', type=int, default=util.OPTIMIZE_PREVIEW_SIZE,
+                        help=_('larger previews are scaled down when optimizing, 0 keeps them '
+                               '(default: {0} pixels, needs PyQt5)').format(util.OPTIMIZE_PREVIEW_SIZE))
+    args = parser.parse_args(argv[1:])
+
+    if not args.paths and not args.regenerate_configs:
+        parser.error(_('at least one PATH is required'))
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error(_('--jobs must be at least 1'))
+    if args.threads < 1:
+        parser.error(_('--threads must be at least 1'))
+    if args.optimize and args.regenerate_configs:
+        parser.error(_('--optimize can\'t be combined with --regenerate-configs'))
+    if args.level is not None and not 1 <= args.level <= 9:
+        parser.error(_('--level must be between 1 and 9'))
+    if args.max_preview < 0:
+        parser.error(_('--max-preview must not be negative'))
+
+    config = Config()
+    config.load()
+    config.extract_threads = args.threads
+    metrics.configure(config)
+
+    if args.regenerate_configs:
+        try:
+            results = regenerate_all(config, args.jobs)
+        except util.Rp9UtilException as ex:
+            sys.stderr.write(str(ex) + '\n')
+            return 1
+        if not results:
+            sys.stderr.write(_('No extracted titles found.') + '\n')
+            return 1
+    else:
+        files = collect_files(args.paths)
+        if not files:
+            sys.stderr.write(_('No rp9 files found.') + '\n')
+            return 1
+        if args.optimize:
+            if args.max_preview and not install_image_codec():
+                sys.stderr.write(_('PyQt5 is not available, the previews are not scaled down.') + '\n')
+            results = optimize_all(files, args.jobs, args.level, args.max_preview)
+        else:
+            results = extract_all(files, config, args.jobs, args.override, args.skip_existing)
+
+    print_summary(results)
+
+    for rp9_file, result, message in results:
+        if result == RESULT_FAILED:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
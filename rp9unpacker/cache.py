@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Disk caches
+#
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from pathlib import Path
+
+
+def default_thumbnail_dir():
+    return Path.home().joinpath('.rp9unpacker-thumbnails')
+
+
+class ThumbnailCache:
+    """Size bounded cache of scaled preview images, the least recently used images are evicted first."""
+
+    def __init__(self, directory=None, max_size=32 * 1024 * 1024):
+        self.directory = default_thumbnail_dir() if directory is None else Path(directory)
+        self.max_size = max_size
+        self.__size = None
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def key(rp9_file, stat, name, crc):
+        identity = '\n'.join([os.path.abspath(str(rp9_file)), str(stat.st_size), str(stat.st_mtime_ns),
+                              name, format(crc, '08x')])
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        path = self.directory.joinpath(key + '.png')
+        try:
+            with open(str(path), 'rb') as file:
+                data = file.read()
+            # the modification time is the last access time of the entry
+            os.utime(str(path))
+            return data
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        if len(data) > self.max_size:
+            return
+
+        if not self.directory.is_dir():
+            self.directory.mkdir(parents=True)
+
+        path = self.directory.joinpath(key + '.png')
+        temp = self.directory.joinpath(key + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp')
+        with open(str(temp), 'wb') as file:
+            file.write(data)
+        os.replace(str(temp), str(path))
+
+        with self.__lock:
+            if self.__size is None:
+                self.__size = self.__disk_size()
+            else:
+                self.__size = self.__size + len(data)
+            if self.__size > self.max_size:
+                self.__size = self.__evict()
+
+    def clear(self):
+        with self.__lock:
+            if self.directory.is_dir():
+                for path in self.directory.iterdir():
+                    self.__unlink(path)
+            self.__size = 0
+
+    def __entries(self):
+        entries = []
+        if self.directory.is_dir():
+            with os.scandir(str(self.directory)) as scan:
+                for entry in scan:
+                    if entry.name.endswith('.png'):
+                        try:
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime_ns, stat.st_size, Path(entry.path)))
+                        except OSError:
+                            pass  # removed by another process
+        return entries
+
+    def __disk_size(self):
+        return sum(size for mtime, size, path in self.__entries())
+
+    def __evict(self):
+        entries = sorted(self.__entries())
+        size = sum(size for mtime, size, path in entries)
+
+        # trim to 90 percent, so not every new entry triggers another eviction
+        limit = self.max_size * 9 // 10
+        for mtime, entry_size, path in entries:
+            if size <= limit:
+                break
+            if self.__unlink(path):
+                size = size - entry_size
+        return size
+
+    @staticmethod
+    def __unlink(path):
+        try:
+            path.unlink()
+            return True
+        except OSError:
+            return False
+
+
+STATE_FILE = 'rp9unpacker-state.json'
+LOCK_FILE = 'rp9unpacker-in-use'
+
+
+def member_path(media_dir, name):
+    """The extracted file of a zip member, raises a ValueError for a name without any file part.
+
+    Backslashes separate directories like slashes, empty, '.' and '..' parts are dropped, so no member can be written
+    outside of the media directory.
+    """
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    if not parts:
+        raise ValueError('Invalid member name: ' + repr(name))
+    return media_dir.joinpath(*parts)
+
+
+def write_extraction_state(media_dir, rp9_file, stat, zipinfos, keep=None):
+    members = {}
+    for zipinfo in zipinfos:
+        if keep is not None and zipinfo.filename in keep:
+            # the file was not written, the state of the last extraction is still valid for it
+            members[zipinfo.filename] = keep[zipinfo.filename]
+            continue
+        path = member_path(media_dir, zipinfo.filename)
+        members[zipinfo.filename] = {
+            'crc': zipinfo.CRC,
+            'size': zipinfo.file_size,
+            'mtime': os.stat(str(path)).st_mtime_ns,
+        }
+    state = {
+        'archive': os.path.abspath(str(rp9_file)),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'members': members,
+    }
+    with open(str(media_dir.joinpath(STATE_FILE)), 'w') as file:
+        json.dump(state, file, indent=4)
+
+
+def read_extraction_state(media_dir):
+    try:
+        with open(str(media_dir.joinpath(STATE_FILE))) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+class ExtractionCache:
+    """Temporary extractions kept for the next run, the least recently used ones are evicted to keep the budget."""
+
+    def __init__(self, directory, max_size):
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+    def entry_dir(self, rp9_file):
+        key = hashlib.sha1(os.path.abspath(str(rp9_file)).encode('utf-8')).hexdigest()
+        return self.directory.joinpath(key)
+
+    def is_valid(self, entry, rp9_file, stat, zipinfos):
+        state = read_extraction_state(entry)
+        if state is None:
+            return False
+        if state.get('archive') != os.path.abspath(str(rp9_file)) or state.get('size') != stat.st_size or \
+                state.get('mtime') != stat.st_mtime_ns:
+            return False
+
+        members = state.get('members', {})
+        for zipinfo in zipinfos:
+            member = members.get(zipinfo.filename)
+            if member is None or member.get('crc') != zipinfo.CRC or member.get('size') != zipinfo.file_size:
+                return False
+            try:
+                # a changed modification time means FS-UAE has written to the file
+                file_stat = os.stat(str(member_path(entry, zipinfo.filename)))
+            except (OSError, ValueError):
+                return False
+            if file_stat.st_size != zipinfo.file_size or file_stat.st_mtime_ns != member.get('mtime'):
+                return False
+        return True
+
+    @staticmethod
+    def touch(entry):
+        os.utime(str(entry.joinpath(STATE_FILE)))
+
+    @staticmethod
+    def lock(entry):
+        path = entry.joinpath(LOCK_FILE)
+        with open(str(path), 'w') as file:
+            file.write(str(os.getpid()))
+        return path
+
+    @staticmethod
+    def is_locked(entry):
+        try:
+            with open(str(entry.joinpath(LOCK_FILE))) as file:
+                pid = int(file.read().strip())
+        except (OSError, ValueError):
+            return False
+
+        try:
+            os.kill(pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except OSError:
+            return True
+
+    def reserve(self, required):
+        """Evicts entries until the required bytes fit into the budget, returns False if they never will."""
+        if required > self.max_size:
+            return False
+        if not self.directory.is_dir():
+            self.directory.mkdir(parents=True)
+            return True
+
+        entries = []
+        total = 0
+        for entry in self.directory.iterdir():
+            if not entry.is_dir():
+                continue
+            size = self.__dir_size(entry)
+            total = total + size
+            try:
+                used = os.stat(str(entry.joinpath(STATE_FILE))).st_mtime_ns
+            except OSError:
+                used = 0
+            entries.append((used, size, entry))
+
+        for used, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total + required <= self.max_size:
+                break
+            if not self.is_locked(entry):
+                shutil.rmtree(str(entry), ignore_errors=True)
+                total = total - size
+        return total + required <= self.max_size
+
+    @staticmethod
+    def __dir_size(path):
+        size = 0
+        for root, dirs, files in os.walk(str(path)):
+            for name in files:
+                try:
+                    size = size + os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass  # ignore
+        return size
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Background removal of temporary directories
+#
+
+import metrics
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from cache import ExtractionCache
+from pathlib import Path
+from queue import Queue
+
+ORPHAN_PREFIX = 'rp9unpacker_'
+TRASH_DIR = 'rp9unpacker-trash'
+
+# seconds the janitor may spend at startup, the rest is reclaimed at the next start
+RECLAIM_BUDGET = 5.0
+
+
+def delete_tree(path, deadline=None):
+    """Deletes a directory bottom up, returns False if the deadline was reached before it was gone."""
+    for root, dirs, files in os.walk(str(path), topdown=False):
+        for name in files:
+            try:
+                os.unlink(os.path.join(root, name))
+            except FileNotFoundError:
+                pass  # removed by another instance
+        for name in dirs:
+            sub = os.path.join(root, name)
+            try:
+                if os.path.islink(sub):
+                    os.unlink(sub)
+                else:
+                    os.rmdir(sub)
+            except FileNotFoundError:
+                pass  # removed by another instance
+        if deadline is not None and time.monotonic() > deadline:
+            return False
+
+    try:
+        os.rmdir(str(path))
+    except FileNotFoundError:
+        pass  # removed by another instance
+    return True
+
+
+def reclaim_orphans(temp_dir, budget=RECLAIM_BUDGET):
+    """Removes the temporary directories left by crashed sessions, the extraction cache is not touched."""
+    if not temp_dir or not Path(temp_dir).is_dir():
+        return 0
+    deadline = time.monotonic() + budget
+    base = Path(temp_dir)
+
+    candidates = []
+    trash = base.joinpath(TRASH_DIR)
+    if trash.is_dir():
+        candidates.extend(trash.iterdir())
+    for path in sorted(base.glob(ORPHAN_PREFIX + '*')):
+        if path.is_dir() and not path.is_symlink():
+            candidates.append(path)
+
+    removed = 0
+    for path in candidates:
+        if time.monotonic() > deadline:
+            break
+        try:
+            if path.parent != trash:
+                path = __claim(path, trash)
+                if path is None:
+                    continue
+            with metrics.phase('reclaim'):
+                if not delete_tree(path, deadline):
+                    break
+            removed = removed + 1
+        except OSError:
+            sys.stderr.write('Could not delete orphaned directory: \'' + str(path) + '\'\n')
+            traceback.print_exc(file=sys.stderr)
+    return removed
+
+
+def __claim(path, trash):
+    # another instance may have extracted to the same name since the candidates were collected, the lock holds the
+    # pid of that instance, only the directory moved into the trash right after the check is deleted
+    if ExtractionCache.is_locked(path):
+        return None
+    trash.mkdir(exist_ok=True)
+    target = trash.joinpath(uuid.uuid4().hex)
+    try:
+        os.rename(str(path), str(target))
+    except FileNotFoundError:
+        return None  # removed by another instance
+    return target
+
+
+class CleanupQueue:
+    """Deletes directories one after the other on a background thread.
+
+    The directories are renamed into a trash directory first, so their names can be used again at once.
+    """
+
+    def __init__(self):
+        self.__queue = Queue()
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+    def remove(self, path):
+        path = Path(path)
+        if not path.is_dir():
+            return
+
+        target = path
+        try:
+            trash = path.parent.joinpath(TRASH_DIR)
+            trash.mkdir(exist_ok=True)
+            target = trash.joinpath(uuid.uuid4().hex)
+            os.rename(str(path), str(target))
+        except OSError:
+            target = path  # deleted in place
+
+        self.__submit(lambda: self.__delete(target))
+
+    def reclaim(self, temp_dir, budget=RECLAIM_BUDGET):
+        self.__submit(lambda: reclaim_orphans(temp_dir, budget))
+
+    def wait(self):
+        self.__queue.join()
+
+    def __submit(self, task):
+        with self.__lock:
+            if self.__thread is None:
+                # a daemon thread, an interrupted deletion is reclaimed at the next start
+                self.__thread = threading.Thread(target=self.__work, name='rp9unpacker-cleanup', daemon=True)
+                self.__thread.start()
+        self.__queue.put(task)
+
+    def __work(self):
+        while True:
+            task = self.__queue.get()
+            try:
+                task()
+            except Exception:
+                sys.stderr.write('Could not clean up temporary files!\n')
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                self.__queue.task_done()
+
+    @staticmethod
+    def __delete(path):
+        try:
+            with metrics.phase('cleanup'):
+                delete_tree(path)
+        except OSError:
+            sys.stderr.write('Could not delete temporary directory: \'' + str(path) + '\'\n')
+            traceback.print_exc(file=sys.stderr)
+
+
+queue = CleanupQueue()
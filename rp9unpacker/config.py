@@ -5,7 +5,10 @@
 #
 
 import json
+import os
 import platform
+import shlex
+import shutil
 import subprocess
 import sys
 import tempfile
@@ -25,33 +28,23 @@ class Config:
         self.current_dir = Path.home()
         self.show_hidden = False
 
+        self.metrics_file = ''
+
         self.fsuae_command = 'fs-uae'
         self.fsuae_documents_dir = ''
         self.fsuae_rp9_dir = ''
+        self.media_store_dir = ''
         self.temp_dir = ''
+        self.direct_launch = False
+        self.temp_cache_size = 0
+        self.extract_threads = 4
+        self.max_sessions = 4
+        self.incremental_extract = True
         self.workbench_135_hd = ''
         self.workbench_211_hd = ''
         self.workbench_311_hd = ''
 
-        # determine default values for linux
         self.temp_dir = tempfile.gettempdir()
-        if 'Linux' == platform.system():
-            try:
-                command = subprocess.getoutput('which fs-uae')
-                if command is not None and len(command) > 0:
-                    if Path(command).is_file():
-                        self.fsuae_command = command
-
-                docs = subprocess.getoutput('xdg-user-dir DOCUMENTS')
-                if docs is not None and len(docs) > 0:
-                    docspath = Path(docs).joinpath('FS-UAE')
-                    if docspath.is_dir():
-                        self.fsuae_documents_dir = str(docspath)
-                        self.fsuae_rp9_dir = str(docspath.joinpath('Amiga Forever'))
-
-            except Exception:
-                sys.stderr.write('Could not determine the system file layout!\n')
-                traceback.print_exc(file=sys.stderr)
 
     def load(self):
         configfile = Path.home().joinpath('.rp9unpacker')
@@ -65,6 +58,50 @@ class Config:
                 sys.stderr.write('Could not read config file: \'' + strfile + '\'\n')
                 traceback.print_exc(file=sys.stderr)
 
+        # the detected values are saved with the config, they are only detected again if they are missing or invalid
+        self.detect()
+
+    def detect(self):
+        if 'Linux' != platform.system():
+            return
+
+        try:
+            if os.sep not in self.fsuae_command or not Path(self.fsuae_command).is_file():
+                # the command is saved with the full path, a bare name is looked up in the PATH
+                command = (self.fsuae_command and shutil.which(self.fsuae_command)) or shutil.which('fs-uae')
+                if command is not None:
+                    self.fsuae_command = command
+
+            if not self.fsuae_documents_dir or not Path(self.fsuae_documents_dir).is_dir():
+                docs = self.__documents_dir()
+                if docs is not None and len(docs) > 0:
+                    docspath = Path(docs).joinpath('FS-UAE')
+                    if docspath.is_dir():
+                        self.fsuae_documents_dir = str(docspath)
+                        if not self.fsuae_rp9_dir:
+                            self.fsuae_rp9_dir = str(docspath.joinpath('Amiga Forever'))
+
+        except Exception:
+            sys.stderr.write('Could not determine the system file layout!\n')
+            traceback.print_exc(file=sys.stderr)
+
+    @staticmethod
+    def __documents_dir():
+        # the same file xdg-user-dir reads, the process is only started if it is missing
+        config_home = os.environ.get('XDG_CONFIG_HOME') or str(Path.home().joinpath('.config'))
+        try:
+            with open(os.path.join(config_home, 'user-dirs.dirs'), encoding='utf-8') as dirs:
+                for line in dirs:
+                    line = line.strip()
+                    if line.startswith('XDG_DOCUMENTS_DIR='):
+                        value = shlex.split(line[len('XDG_DOCUMENTS_DIR='):])
+                        if value:
+                            return value[0].replace('$HOME', str(Path.home()))
+        except (OSError, ValueError):
+            pass  # not configured
+
+        return subprocess.getoutput('xdg-user-dir DOCUMENTS')
+
     def __parsedata(self, data):
         mainwin = data.get('mainwindow', None)
         if mainwin is not None:
@@ -82,12 +119,22 @@ class Config:
                     self.current_dir = curdir
             self.show_hidden = filemanager.get('show-hidden', self.show_hidden)
 
+        diagnostics = data.get('diagnostics', None)
+        if diagnostics is not None:
+            self.metrics_file = diagnostics.get('metrics-file', self.metrics_file)
+
         fs_uae = data.get('fs-uae', None)
         if fs_uae is not None:
             self.fsuae_command = fs_uae.get('command', self.fsuae_command)
             self.fsuae_documents_dir = fs_uae.get('documents-dir', self.fsuae_documents_dir)
             self.fsuae_rp9_dir = fs_uae.get('rp9-dir', self.fsuae_rp9_dir)
+            self.media_store_dir = fs_uae.get('media-store-dir', self.media_store_dir)
             self.temp_dir = fs_uae.get('temp-dir', self.temp_dir)
+            self.direct_launch = fs_uae.get('direct-launch', self.direct_launch)
+            self.temp_cache_size = fs_uae.get('temp-cache-size', self.temp_cache_size)
+            self.extract_threads = fs_uae.get('extract-threads', self.extract_threads)
+            self.max_sessions = fs_uae.get('max-sessions', self.max_sessions)
+            self.incremental_extract = fs_uae.get('incremental-extract', self.incremental_extract)
             self.workbench_135_hd = fs_uae.get('workbench_135_hd', self.workbench_135_hd)
             self.workbench_211_hd = fs_uae.get('workbench_211_hd', self.workbench_211_hd)
             self.workbench_311_hd = fs_uae.get('workbench_311_hd', self.workbench_311_hd)
@@ -107,14 +154,24 @@ class Config:
             'command': self.fsuae_command,
             'documents-dir': self.fsuae_documents_dir,
             'rp9-dir': self.fsuae_rp9_dir,
+            'media-store-dir': self.media_store_dir,
             'temp-dir': self.temp_dir,
+            'direct-launch': self.direct_launch,
+            'temp-cache-size': self.temp_cache_size,
+            'extract-threads': self.extract_threads,
+            'max-sessions': self.max_sessions,
+            'incremental-extract': self.incremental_extract,
             'workbench_135_hd': self.workbench_135_hd,
             'workbench_211_hd': self.workbench_211_hd,
             'workbench_311_hd': self.workbench_311_hd,
         }
+        diagnostics = {
+            'metrics-file': self.metrics_file,
+        }
         data = {
             'mainwindow': mainwin,
             'filemanager': filemanager,
+            'diagnostics': diagnostics,
             'fs-uae': fs_uae,
         }
 
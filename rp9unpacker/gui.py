@@ -4,23 +4,31 @@
 # The gui
 #
 
+import cleanup
 import constants as const
+import metrics
+import rp9qt
 import rp9util as util
 from config import Config
+from rp9index import FACET_FIELDS, LIBRARY_FIELDS
 
+import bisect
 import gettext
 import os
 import sys
+import time
 import traceback
 
 from pathlib import Path
 from zipfile import is_zipfile
-from PyQt5.QtGui import QIcon, QPixmap, QTextCursor
-from PyQt5.QtCore import pyqtSlot, Qt, QSize, QThread
+from PyQt5.QtGui import QIcon, QIntValidator, QPixmap, QTextCursor
+from PyQt5.QtCore import (pyqtSignal, pyqtSlot, QAbstractListModel, QAbstractTableModel, QFileSystemWatcher,
+                          QModelIndex, QObject, Qt, QSize, QThread, QTimer)
 from PyQt5.QtWidgets import (QAbstractItemView, QAction, QCheckBox, QDialog, QFileDialog, QHBoxLayout, QLabel,
                              QListWidget, QListWidgetItem, QMainWindow, QPlainTextEdit, QPushButton, QSizePolicy,
                              QSplitter, QVBoxLayout, QWidget, QFrame, QDialogButtonBox, QGridLayout, QLineEdit,
-                             QMessageBox, QTableWidget, QTableWidgetItem, QListView, QLayout)
+                             QMessageBox, QTableWidget, QTableWidgetItem, QListView, QLayout, QProgressDialog,
+                             QApplication, QComboBox, QHeaderView, QTableView)
 
 images_path = Path(__file__).parent.joinpath('images')
 resources_path = Path(__file__).parent.joinpath('resources')
@@ -29,6 +37,11 @@ localedir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'locales')
 translate = gettext.translation('gui', localedir, fallback=True)
 _ = translate.gettext
 
+rp9qt.install()
+
+# rp9 files before and after the selected one which are loaded in the background
+PREFETCH_DISTANCE = 3
+
 
 class AboutDialog(QDialog):
 
@@ -82,6 +95,127 @@ class AboutDialog(QDialog):
         self.resize(600, 400)
 
 
+class DirectoryScanWorker(QObject):
+    entriesSignal = pyqtSignal(int, list, list)
+    refreshSignal = pyqtSignal(int, list, list, list)
+    exitSignal = pyqtSignal(int)
+
+    def __init__(self, scan_id, path, show_hidden, batch_size=100, batch_interval=0.2, known_files=None):
+        super().__init__()
+
+        self.scan_id = scan_id
+        self.path = path
+        self.show_hidden = show_hidden
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.known_files = set() if known_files is None else known_files
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    @pyqtSlot()
+    def execute(self):
+        folders = []
+        files = []
+        last_batch = time.monotonic()
+        try:
+            with os.scandir(str(self.path)) as entries:
+                for entry in entries:
+                    if self.cancelled:
+                        break
+                    if entry.name.startswith('.') and not self.show_hidden:
+                        continue
+
+                    try:
+                        if entry.is_dir():
+                            folders.append(entry.name)
+                        elif entry.is_file():
+                            if entry.name.lower().endswith('.rp9') and is_zipfile(entry.path):
+                                files.append(entry.name)
+                    except OSError:
+                        pass  # ignore
+
+                    now = time.monotonic()
+                    if len(folders) + len(files) >= self.batch_size or \
+                            (now - last_batch >= self.batch_interval and (folders or files)):
+                        self.entriesSignal.emit(self.scan_id, folders, files)
+                        folders = []
+                        files = []
+                        last_batch = now
+
+        except OSError:
+            sys.stderr.write('Could not read directory: \'' + str(self.path) + '\'\n')
+            traceback.print_exc(file=sys.stderr)
+
+        if not self.cancelled and (folders or files):
+            self.entriesSignal.emit(self.scan_id, folders, files)
+        self.exitSignal.emit(self.scan_id)
+
+    @pyqtSlot()
+    def refresh(self):
+        # the complete listing at once, the list is only changed by the difference to it
+        folders = []
+        files = []
+        incomplete = []
+        try:
+            with os.scandir(str(self.path)) as entries:
+                for entry in entries:
+                    if self.cancelled:
+                        break
+                    if entry.name.startswith('.') and not self.show_hidden:
+                        continue
+
+                    try:
+                        if entry.is_dir():
+                            folders.append(entry.name)
+                        elif entry.is_file() and entry.name.lower().endswith('.rp9'):
+                            # files still being copied are no valid zip files yet
+                            if entry.name in self.known_files or is_zipfile(entry.path):
+                                files.append(entry.name)
+                            else:
+                                incomplete.append(entry.path)
+                    except OSError:
+                        pass  # ignore
+
+        except OSError:
+            pass  # the directory was removed, all entries are gone
+
+        if not self.cancelled:
+            self.refreshSignal.emit(self.scan_id, folders, files, incomplete)
+        self.exitSignal.emit(self.scan_id)
+
+
+class ExtractionProgressDialog(QProgressDialog):
+
+    def __init__(self, title, *args):
+        QProgressDialog.__init__(self, _('Extracting rp9 file...'), _('Cancel'), 0, 1000, *args)
+        self.setWindowTitle(title)
+        self.setWindowModality(Qt.WindowModal)
+        self.setMinimumDuration(500)
+        self.setAutoClose(False)
+        self.setAutoReset(False)
+        self.started = time.monotonic()
+        self.progress = util.Rp9Progress(self.update_progress)
+
+    def update_progress(self, progress):
+        if progress.total > 0:
+            self.setValue(int(progress.done * 1000 / progress.total))
+
+        elapsed = time.monotonic() - self.started
+        text = _('Extracting rp9 file...')
+        if progress.member is not None:
+            text = progress.member + ' (' + str(progress.member_done // 1048576) + ' / ' + \
+                   str(progress.member_total // 1048576) + ' MB)'
+        if elapsed > 0:
+            text = text + '\n' + '{0:.1f} MB/s'.format(progress.done / elapsed / 1048576)
+        self.setLabelText(text)
+
+        QApplication.processEvents()
+        if self.wasCanceled():
+            progress.cancel()
+
+
 class DirectoryFieldButton(QPushButton):
 
     def __init__(self, icon, parent, ledit, dirsonly):
@@ -120,10 +254,20 @@ class SettingsDialog(QDialog):
         self.fsuae_command_edit = self.__lineedit()
         self.fsuae_documents_dir_edit = self.__lineedit()
         self.fsuae_rp9_dir_edit = self.__lineedit()
+        self.media_store_dir_edit = self.__lineedit()
         self.temp_dir_edit = self.__lineedit()
+        self.temp_cache_size_edit = self.__lineedit()
+        self.temp_cache_size_edit.setValidator(QIntValidator(0, 1024 * 1024))
+        self.extract_threads_edit = self.__lineedit()
+        self.extract_threads_edit.setValidator(QIntValidator(1, 64))
+        self.max_sessions_edit = self.__lineedit()
+        self.max_sessions_edit.setValidator(QIntValidator(1, 64))
         self.workbench_135_hd_edit = self.__lineedit()
         self.workbench_211_hd_edit = self.__lineedit()
         self.workbench_311_hd_edit = self.__lineedit()
+        self.incremental_extract_check = QCheckBox(_('Only rewrite changed files when overriding an extraction'))
+        self.direct_launch_check = QCheckBox(_('Run temporary without extracting, if FS-UAE can read the media '
+                                               'from the rp9 file'))
 
         dlglyt = QVBoxLayout()
         dlglyt.setSizeConstraint(QLayout.SetFixedSize)
@@ -145,21 +289,37 @@ class SettingsDialog(QDialog):
         grid.addWidget(self.fsuae_rp9_dir_edit, 2, 1)
         grid.addWidget(self.__dirbutton(self.fsuae_rp9_dir_edit, True), 2, 2)
 
-        grid.addWidget(self.__label(_('Temp directory:')), 3, 0)
-        grid.addWidget(self.temp_dir_edit, 3, 1)
-        grid.addWidget(self.__dirbutton(self.temp_dir_edit, True), 3, 2)
+        grid.addWidget(self.__label(_('Media store directory:')), 3, 0)
+        grid.addWidget(self.media_store_dir_edit, 3, 1)
+        grid.addWidget(self.__dirbutton(self.media_store_dir_edit, True), 3, 2)
+
+        grid.addWidget(self.__label(_('Temp directory:')), 4, 0)
+        grid.addWidget(self.temp_dir_edit, 4, 1)
+        grid.addWidget(self.__dirbutton(self.temp_dir_edit, True), 4, 2)
+
+        grid.addWidget(self.__label(_('Temporary cache size (MB):')), 5, 0)
+        grid.addWidget(self.temp_cache_size_edit, 5, 1)
+
+        grid.addWidget(self.__label(_('Workbench-135 harddisk:')), 6, 0)
+        grid.addWidget(self.workbench_135_hd_edit, 6, 1)
+        grid.addWidget(self.__dirbutton(self.workbench_135_hd_edit, False), 6, 2)
+
+        grid.addWidget(self.__label(_('Workbench-211 harddisk:')), 7, 0)
+        grid.addWidget(self.workbench_211_hd_edit, 7, 1)
+        grid.addWidget(self.__dirbutton(self.workbench_211_hd_edit, False), 7, 2)
+
+        grid.addWidget(self.__label(_('Workbench-311 harddisk:')), 8, 0)
+        grid.addWidget(self.workbench_311_hd_edit, 8, 1)
+        grid.addWidget(self.__dirbutton(self.workbench_311_hd_edit, False), 8, 2)
 
-        grid.addWidget(self.__label(_('Workbench-135 harddisk:')), 4, 0)
-        grid.addWidget(self.workbench_135_hd_edit, 4, 1)
-        grid.addWidget(self.__dirbutton(self.workbench_135_hd_edit, False), 4, 2)
+        grid.addWidget(self.__label(_('Extraction threads:')), 9, 0)
+        grid.addWidget(self.extract_threads_edit, 9, 1)
 
-        grid.addWidget(self.__label(_('Workbench-211 harddisk:')), 5, 0)
-        grid.addWidget(self.workbench_211_hd_edit, 5, 1)
-        grid.addWidget(self.__dirbutton(self.workbench_211_hd_edit, False), 5, 2)
+        grid.addWidget(self.__label(_('Concurrent FS-UAE sessions:')), 10, 0)
+        grid.addWidget(self.max_sessions_edit, 10, 1)
 
-        grid.addWidget(self.__label(_('Workbench-311 harddisk:')), 6, 0)
-        grid.addWidget(self.workbench_311_hd_edit, 6, 1)
-        grid.addWidget(self.__dirbutton(self.workbench_311_hd_edit, False), 6, 2)
+        grid.addWidget(self.incremental_extract_check, 11, 1, 1, 2)
+        grid.addWidget(self.direct_launch_check, 12, 1, 1, 2)
 
         dlglyt.addSpacing(10)
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
@@ -190,11 +350,20 @@ class Rp9Viewer(QFrame):
         QFrame.__init__(self, *args)
 
         self.config = conf
-        self.worker = None
-        self.thread = None
+        self.launcher = rp9qt.Rp9Launcher(conf.max_sessions, self)
         self.rp9_file = None
+        self.rp9_archives = util.Rp9ArchivePool(4 * PREFETCH_DISTANCE + 4)
+        self.rp9_prefetcher = util.Rp9Prefetcher(self.rp9_archives)
         self.rp9_documents = []
         self.rp9_images = []
+        self.pending_extras = []
+        self.help_with_title = False
+        self.help_newline = False
+
+        # the help documents and images are shown one by one after the metadata
+        self.extras_timer = QTimer(self)
+        self.extras_timer.setInterval(0)
+        self.extras_timer.timeout.connect(self.load_next_extra)
 
         self.line_edits = []
         self.title_edit = self.__lineedit()
@@ -219,8 +388,8 @@ class Rp9Viewer(QFrame):
         self.image_list = QListWidget()
         self.image_list.setSelectionMode(QAbstractItemView.NoSelection)
         self.image_list.setViewMode(QListView.IconMode)
-        self.image_list.setIconSize(QSize(160, 160))
-        self.image_list.setGridSize(QSize(170, 170))
+        self.image_list.setIconSize(QSize(util.THUMBNAIL_SIZE, util.THUMBNAIL_SIZE))
+        self.image_list.setGridSize(QSize(util.THUMBNAIL_SIZE + 10, util.THUMBNAIL_SIZE + 10))
         self.image_list.setStyleSheet("QListWidget::item {border-top: 4px solid transparent; }")
 
         vbox = QVBoxLayout()
@@ -277,11 +446,6 @@ class Rp9Viewer(QFrame):
         self.run_from_config_button.setEnabled(False)
         self.write_config_button.setEnabled(False)
 
-    @pyqtSlot()
-    def exit_thread(self):
-        if self.thread is not None and self.thread.isRunning():
-            self.thread.exit()
-
     @pyqtSlot()
     def run_from_temp(self):
         self.__run(True)
@@ -290,7 +454,7 @@ class Rp9Viewer(QFrame):
     def run_from_config(self):
         try:
             override = False
-            if util.is_already_extracted(self.rp9_file, self.config):
+            if self.__archive().is_already_extracted(self.config):
                 choice = QMessageBox.question(self, _('Extract rp9'),
                                               _('This rp9 file was already extracted. Override the existing files?'),
                                               QMessageBox.Yes | QMessageBox.No)
@@ -306,17 +470,26 @@ class Rp9Viewer(QFrame):
 
     def __run(self, temporary, override=False):
         try:
-            if self.thread is not None and self.thread.isRunning():
-                QMessageBox.warning(self, _('Run rp9'), _('The previous fs-uae process is still running.'),
+            self.launcher.max_sessions = self.config.max_sessions
+            if not self.launcher.can_start():
+                QMessageBox.warning(self, _('Run rp9'),
+                                    _('Already {0} fs-uae processes are running.').format(len(self.launcher.sessions)),
                                     QMessageBox.Ok)
                 return
 
-            self.worker = util.run(self.rp9_file, self.config, temporary, override)
-            self.thread = QThread()
-            self.thread.started.connect(self.worker.execute)
-            self.worker.moveToThread(self.thread)
-            self.worker.exitSignal.connect(self.exit_thread)
-            self.thread.start()
+            dialog = ExtractionProgressDialog(_('Run rp9'), self)
+            try:
+                process = self.__archive().run(self.config, temporary, override, dialog.progress)
+            finally:
+                dialog.close()
+            self.launcher.start(process, self.rp9_file.name)
+            if process.report is not None and process.report.modified:
+                QMessageBox.warning(self, _('Run rp9'), _('These files were changed since the last extraction and '
+                                                          'were kept:') + '\n' + '\n'.join(process.report.modified),
+                                    QMessageBox.Ok)
+
+        except util.Rp9CancelledException:
+            pass
 
         except util.Rp9UtilException as ex:
             QMessageBox.critical(self, _('Run rp9'), str(ex), QMessageBox.Ok)
@@ -330,7 +503,7 @@ class Rp9Viewer(QFrame):
     def write_config(self):
         try:
             override = False
-            if util.is_already_extracted(self.rp9_file, self.config):
+            if self.__archive().is_already_extracted(self.config):
                 choice = QMessageBox.question(self, _('Extract rp9'),
                                               _('This rp9 file was already extracted. Override the existing files?'),
                                               QMessageBox.Yes | QMessageBox.No)
@@ -339,13 +512,35 @@ class Rp9Viewer(QFrame):
                 else:
                     return
 
-            util.extract(self.rp9_file, self.config, override)
-            QMessageBox.warning(self, _('Extract rp9'), _('The rp9 file was successfully extracted.'),
-                                QMessageBox.Ok)
+            dialog = ExtractionProgressDialog(_('Extract rp9'), self)
+            try:
+                report = self.__archive().extract(self.config, override, dialog.progress)
+            finally:
+                dialog.close()
+            message = _('The rp9 file was successfully extracted.')
+            if report.modified:
+                message = message + '\n\n' + _('These files were changed since the last extraction and were '
+                                                'kept:') + '\n' + '\n'.join(report.modified)
+            QMessageBox.warning(self, _('Extract rp9'), message, QMessageBox.Ok)
+
+        except util.Rp9CancelledException:
+            pass
 
         except util.Rp9UtilException as ex:
             QMessageBox.critical(self, _('Run rp9'), str(ex), QMessageBox.Ok)
 
+    def __archive(self):
+        # never waits for the prefetch, only the manifest is read here and the extras are loaded by their handles
+        self.rp9_prefetcher.cancel(self.rp9_file)
+        return self.rp9_archives.get(self.rp9_file)
+
+    def prefetch(self, files):
+        self.rp9_prefetcher.prefetch(files)
+
+    def close_archives(self):
+        self.rp9_prefetcher.shutdown()
+        self.rp9_archives.close()
+
     @staticmethod
     def __label(name):
         label = QLabel(name)
@@ -364,9 +559,49 @@ class Rp9Viewer(QFrame):
         self.line_edits.append(edit)
         return edit
 
+    @pyqtSlot()
+    def load_next_extra(self):
+        if not self.pending_extras:
+            self.extras_timer.stop()
+            return
+
+        extra = self.pending_extras.pop(0)
+        try:
+            if isinstance(extra, util.Rp9Help):
+                self.__show_help(extra)
+            else:
+                self.__show_image(extra)
+        except Exception:
+            sys.stderr.write('Could not read embedded file: \'' + str(extra.name) + '\'\n')
+            traceback.print_exc(file=sys.stderr)
+
+    def __show_help(self, helpdoc):
+        if helpdoc.text is not None:
+            # the document is appended, even if the user has moved the cursor meanwhile
+            self.help_edit.moveCursor(QTextCursor.End)
+            if self.help_with_title:
+                if self.help_newline:
+                    self.help_edit.insertPlainText('\n')
+                self.help_newline = True
+                self.help_edit.insertPlainText(helpdoc.name)
+                self.help_edit.insertPlainText('\n')
+                for i in range(len(helpdoc.name)):
+                    self.help_edit.insertPlainText('=')
+                self.help_edit.insertPlainText('\n')
+            self.help_edit.insertPlainText(helpdoc.text)
+            self.help_edit.moveCursor(QTextCursor.Start)
+
+    def __show_image(self, image):
+        if image.image is not None:
+            icon = QIcon()
+            icon.addPixmap(QPixmap.fromImage(image.image), QIcon.Normal, QIcon.Off)
+            self.image_list.addItem(QListWidgetItem(icon, ''))
+
     def open_rp9(self, file):
 
         self.rp9_file = file
+        self.extras_timer.stop()
+        self.pending_extras = []
         for edit in self.line_edits:
             edit.clear()
         self.media_table.setRowCount(0)
@@ -378,7 +613,7 @@ class Rp9Viewer(QFrame):
         self.write_config_button.setEnabled(False)
 
         try:
-            info = util.get_info(self.rp9_file, load_extras=True)
+            info = self.__archive().get_info()
 
             self.title_edit.setText(info.description_title)
             self.publisher_edit.setText(info.description_publisher)
@@ -399,26 +634,11 @@ class Rp9Viewer(QFrame):
                 self.media_table.setItem(i, 2, QTableWidgetItem(media.name))
             self.media_table.resizeColumnsToContents()
 
-            with_title = len(info.embedded_help) > 1
-            newline = False
-            for helpdoc in info.embedded_help:
-                if helpdoc.text is not None:
-                    if with_title:
-                        if newline:
-                            self.help_edit.insertPlainText('\n')
-                        newline = True
-                        self.help_edit.insertPlainText(helpdoc.name)
-                        self.help_edit.insertPlainText('\n')
-                        for i in range(len(helpdoc.name)):
-                            self.help_edit.insertPlainText('=')
-                        self.help_edit.insertPlainText('\n')
-                    self.help_edit.insertPlainText(helpdoc.text)
-
-            for image in info.embedded_images:
-                if image.image is not None:
-                    icon = QIcon()
-                    icon.addPixmap(QPixmap.fromImage(image.image), QIcon.Normal, QIcon.Off)
-                    self.image_list.addItem(QListWidgetItem(icon, ''))
+            self.help_with_title = len(info.embedded_help) > 1
+            self.help_newline = False
+            self.pending_extras = info.embedded_help + info.embedded_images
+            if self.pending_extras:
+                self.extras_timer.start()
 
             self.run_from_temp_button.setEnabled(True)
             self.run_from_config_button.setEnabled(True)
@@ -433,6 +653,404 @@ class Rp9Viewer(QFrame):
             QMessageBox.critical(self, _('Open rp9'), _('This is not a valid rp9 file!'), QMessageBox.Ok)
 
 
+class DirectoryModel(QAbstractListModel):
+    """Entries of the current directory, the parent entry first, then the folders and the rp9 files."""
+
+    def __init__(self, *args):
+        QAbstractListModel.__init__(self, *args)
+
+        # one icon instance for all rows
+        self.folder_icon = QIcon.fromTheme('folder')
+        self.file_icon = QIcon.fromTheme('fs-uae', QIcon.fromTheme('package-x-generic'))
+        self.has_parent = False
+        self.folders = []
+        self.files = []
+
+    def clear(self, has_parent):
+        self.beginResetModel()
+        self.has_parent = has_parent
+        self.folders = []
+        self.files = []
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return (1 if self.has_parent else 0) + len(self.folders) + len(self.files)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.name(index.row())
+        if role == Qt.DecorationRole:
+            return self.file_icon if index.row() >= self.__files_offset() else self.folder_icon
+        return None
+
+    def name(self, row):
+        if self.has_parent:
+            if row == 0:
+                return '..'
+            row = row - 1
+        if row < len(self.folders):
+            return self.folders[row][1]
+        return self.files[row - len(self.folders)][1]
+
+    def is_file(self, row):
+        return (1 if self.has_parent else 0) + len(self.folders) <= row < self.rowCount()
+
+    def folder_names(self):
+        return set(name for key, name in self.folders)
+
+    def file_names(self):
+        return set(name for key, name in self.files)
+
+    def add(self, folders, files):
+        self.__add(self.folders, folders, 1 if self.has_parent else 0)
+        self.__add(self.files, files, self.__files_offset())
+
+    def remove(self, folders, files):
+        # files first, their rows depend on the number of folders
+        self.__remove(self.files, files, self.__files_offset())
+        self.__remove(self.folders, folders, 1 if self.has_parent else 0)
+
+    def __files_offset(self):
+        return (1 if self.has_parent else 0) + len(self.folders)
+
+    def __add(self, entries, names, offset):
+        # neighbouring new entries are inserted together, a sorted batch into an empty list is a single insert
+        run = []
+        start = 0
+        for entry in sorted((name.lower(), name) for name in names):
+            index = bisect.bisect(entries, entry)
+            if run and index == start:
+                run.append(entry)
+                continue
+            self.__insert(entries, start, run, offset)
+            run = [entry]
+            start = bisect.bisect(entries, entry)
+        self.__insert(entries, start, run, offset)
+
+    def __insert(self, entries, start, run, offset):
+        if run:
+            self.beginInsertRows(QModelIndex(), offset + start, offset + start + len(run) - 1)
+            entries[start:start] = run
+            self.endInsertRows()
+
+    def __remove(self, entries, names, offset):
+        for name in names:
+            entry = (name.lower(), name)
+            index = bisect.bisect_left(entries, entry)
+            if index < len(entries) and entries[index] == entry:
+                self.beginRemoveRows(QModelIndex(), offset + index, offset + index)
+                del entries[index]
+                self.endRemoveRows()
+
+
+class LibraryScanWorker(QObject):
+    progressSignal = pyqtSignal(int)
+    exitSignal = pyqtSignal(int)
+
+    def __init__(self, path):
+        super().__init__()
+
+        self.path = path
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    @pyqtSlot()
+    def execute(self):
+        index = util.manifest_index
+        count = 0
+        if index is None:
+            self.exitSignal.emit(count)
+            return
+
+        reported = 0
+        found = set()
+        for root, dirs, files in os.walk(str(self.path)):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            for name in files:
+                if self.cancelled:
+                    self.exitSignal.emit(count)
+                    return
+                if not name.lower().endswith('.rp9'):
+                    continue
+
+                # known files are only looked up in the index, new ones are parsed and added to it
+                file = os.path.join(root, name)
+                found.add(index.key(file))
+                try:
+                    util.get_info(file)
+                    count = count + 1
+                except util.Rp9UtilException:
+                    pass  # not an amiga rp9 file
+                if count - reported >= 200:
+                    self.progressSignal.emit(count)
+                    reported = count
+
+        # titles removed from the directory are removed from the library
+        try:
+            for path in index.paths(self.path):
+                if path not in found and not os.path.exists(path):
+                    index.remove(path)
+        except Exception:
+            sys.stderr.write('Could not clean up manifest index: \'' + str(self.path) + '\'\n')
+            traceback.print_exc(file=sys.stderr)
+        self.exitSignal.emit(count)
+
+
+class LibraryModel(QAbstractTableModel):
+    """Titles of the manifest index, rows are handed to the view in chunks while it scrolls."""
+
+    FETCH_SIZE = 500
+
+    def __init__(self, *args):
+        QAbstractTableModel.__init__(self, *args)
+
+        self.headers = [_('Title'), _('Publisher'), _('Genre'), _('Year'), _('System'), _('Media')]
+        self.rows = []
+        self.loaded = 0
+        self.filters = {}
+        self.text = ''
+        self.order = 0
+        self.descending = False
+
+    def refresh(self):
+        # the index is dropped by the background threads after an error
+        index = util.manifest_index
+        self.beginResetModel()
+        try:
+            if index is None:
+                self.rows = []
+            else:
+                self.rows = index.library(self.filters, self.text, LIBRARY_FIELDS[self.order], self.descending)
+        except Exception:
+            sys.stderr.write('Could not read manifest index: \'' + str(index.file) + '\'\n')
+            traceback.print_exc(file=sys.stderr)
+            self.rows = []
+        self.loaded = min(len(self.rows), self.FETCH_SIZE)
+        self.endResetModel()
+
+    def path(self, row):
+        return Path(self.rows[row][0])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.loaded < len(self.rows)
+
+    def fetchMore(self, parent):
+        count = min(len(self.rows) - self.loaded, self.FETCH_SIZE)
+        if parent.isValid() or count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded = self.loaded + count
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            value = self.rows[index.row()][index.column() + 1]
+            return '' if value is None else str(value)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.order = column
+        self.descending = order == Qt.DescendingOrder
+        self.refresh()
+
+
+class LibraryWindow(QDialog):
+    openSignal = pyqtSignal(str)
+
+    def __init__(self, conf, *args):
+        QDialog.__init__(self, *args)
+        self.setWindowTitle(_('Library'))
+
+        self.config = conf
+        self.scan_thread = None
+        self.scan_worker = None
+
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText(_('Search title'))
+        self.facet_boxes = {}
+        self.facet_values = {}
+        for field in FACET_FIELDS:
+            box = QComboBox()
+            box.setSizeAdjustPolicy(QComboBox.AdjustToContents)
+            self.facet_boxes[field] = box
+            self.facet_values[field] = []
+
+        self.model = LibraryModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSortingEnabled(True)
+        self.table.sortByColumn(0, Qt.AscendingOrder)
+        self.table.verticalHeader().hide()
+        # fixed row heights, the view does not have to measure the rows
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+
+        self.status_label = QLabel()
+        self.add_button = QPushButton(QIcon.fromTheme('folder-open'), _('Add directory...'))
+
+        # the filters are applied once the typing pauses
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(250)
+
+        self.search_edit.textChanged.connect(self.search_timer.start)
+        self.search_timer.timeout.connect(self.refresh)
+        for box in self.facet_boxes.values():
+            box.activated.connect(self.refresh)
+        self.table.doubleClicked.connect(self.open_title)
+        self.add_button.clicked.connect(self.add_directory)
+
+        vbox = QVBoxLayout()
+        self.setLayout(vbox)
+
+        filters = QHBoxLayout()
+        vbox.addLayout(filters)
+        filters.addWidget(self.search_edit, 1)
+        labels = {
+            'description_genre': _('Genre:'),
+            'description_year': _('Year:'),
+            'description_publisher': _('Publisher:'),
+            'configuration_system': _('System:'),
+            'media_type': _('Media:'),
+        }
+        for field in FACET_FIELDS:
+            filters.addWidget(QLabel(labels[field]))
+            filters.addWidget(self.facet_boxes[field])
+
+        vbox.addWidget(self.table)
+
+        bottom = QHBoxLayout()
+        vbox.addLayout(bottom)
+        bottom.addWidget(self.status_label, 1)
+        bottom.addWidget(self.add_button)
+
+        self.resize(900, 600)
+        self.refresh()
+
+    def filters(self):
+        filters = {}
+        for field in FACET_FIELDS:
+            index = self.facet_boxes[field].currentIndex()
+            # the first entry shows all titles
+            if 0 < index <= len(self.facet_values[field]):
+                filters[field] = self.facet_values[field][index - 1]
+        return filters
+
+    @pyqtSlot()
+    def refresh(self):
+        index = util.manifest_index
+        if index is None:
+            self.model.refresh()
+            self.status_label.setText(_('The library is not available.'))
+            return
+
+        filters = self.filters()
+        text = self.search_edit.text().strip()
+        self.model.filters = filters
+        self.model.text = text
+        self.model.refresh()
+
+        # the counts of each facet depend on the other selected facets
+        try:
+            for field in FACET_FIELDS:
+                box = self.facet_boxes[field]
+                values = index.facet(field, filters, text)
+                box.blockSignals(True)
+                box.clear()
+                box.addItem(_('All'))
+                self.facet_values[field] = []
+                for value, count in values:
+                    self.facet_values[field].append(value)
+                    box.addItem(('-' if value is None else str(value)) + ' (' + str(count) + ')')
+                if field in filters and filters[field] in self.facet_values[field]:
+                    box.setCurrentIndex(self.facet_values[field].index(filters[field]) + 1)
+                box.blockSignals(False)
+        except Exception:
+            sys.stderr.write('Could not read manifest index: \'' + str(index.file) + '\'\n')
+            traceback.print_exc(file=sys.stderr)
+
+        self.status_label.setText(_('{0} titles').format(len(self.model.rows)))
+
+    @pyqtSlot(QModelIndex)
+    def open_title(self, index):
+        file = self.model.path(index.row())
+        if file.is_file():
+            self.openSignal.emit(str(file))
+        else:
+            index = util.manifest_index
+            if index is not None:
+                index.remove(file)
+            self.refresh()
+            QMessageBox.warning(self, _('Library'), _('The rp9 file does not exist anymore.'), QMessageBox.Ok)
+
+    @pyqtSlot()
+    def add_directory(self):
+        if util.manifest_index is None or self.scan_thread is not None:
+            return
+        filename = QFileDialog.getExistingDirectory(self, _('Add directory to library'), str(self.config.current_dir),
+                                                    QFileDialog.ShowDirsOnly | QFileDialog.DontUseNativeDialog)
+        if filename:
+            self.scan(Path(filename))
+
+    def scan(self, path):
+        self.add_button.setEnabled(False)
+        self.status_label.setText(_('Reading {0}...').format(str(path)))
+        worker = LibraryScanWorker(path)
+        thread = QThread()
+        thread.started.connect(worker.execute)
+        worker.moveToThread(thread)
+        worker.progressSignal.connect(self.scan_progress)
+        worker.exitSignal.connect(self.scan_finished)
+        self.scan_worker = worker
+        self.scan_thread = thread
+        thread.start()
+
+    @pyqtSlot(int)
+    def scan_progress(self, count):
+        self.refresh()
+        self.status_label.setText(_('{0} titles read...').format(count))
+
+    @pyqtSlot(int)
+    def scan_finished(self, count):
+        if self.scan_thread is not None:
+            self.scan_thread.quit()
+            self.scan_thread.wait()
+        self.scan_thread = None
+        self.scan_worker = None
+        self.add_button.setEnabled(True)
+        self.refresh()
+
+    def closeEvent(self, event):
+        if self.scan_thread is not None:
+            self.scan_worker.cancel()
+            self.scan_thread.quit()
+            self.scan_thread.wait()
+            self.scan_thread = None
+            self.scan_worker = None
+            self.add_button.setEnabled(True)
+        super(LibraryWindow, self).closeEvent(event)
+
+
 class MainWindow(QMainWindow):
 
     def __init__(self, *args):
@@ -444,21 +1062,40 @@ class MainWindow(QMainWindow):
         # load config
         self.config = Config()
         self.config.load()
+        metrics.configure(self.config)
         self.current_dir = self.config.current_dir
 
+        self.scan_id = 0
+        self.scan_worker = None
+        self.scan_threads = []
+        self.library_window = None
+        self.refresh_pending = False
+
+        # changes of the current directory are applied to the list without a rescan
+        self.dir_watcher = QFileSystemWatcher(self)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(200)
+
         self.move(self.config.mainwindow_x, self.config.mainwindow_y)
         self.resize(self.config.mainwindow_witdh, self.config.mainwindow_height)
 
         # Menu Bar
         self.settings_action = QAction(_('Settings'), self)
+        self.regenerate_action = QAction(_('Rewrite all configurations'), self)
         self.exit_action = QAction(_('Exit'), self)
         self.exit_action.setMenuRole(QAction.QuitRole)
 
         file_menu = self.menuBar().addMenu(_('Program'))
         file_menu.addAction(self.settings_action)
+        file_menu.addAction(self.regenerate_action)
         file_menu.addSeparator()
         file_menu.addAction(self.exit_action)
 
+        self.library_action = QAction(_('Show library'), self)
+        library_menu = self.menuBar().addMenu(_('Library'))
+        library_menu.addAction(self.library_action)
+
         self.about_action = QAction(_('About'), self)
         help_menu = self.menuBar().addMenu(_('Help'))
         help_menu.addAction(self.about_action)
@@ -466,18 +1103,34 @@ class MainWindow(QMainWindow):
         # Widgets
         self.splitter = QSplitter(Qt.Horizontal)
         self.rp9_viewer = Rp9Viewer(self.config)
-        self.file_list = QListWidget()
+        self.file_model = DirectoryModel(self)
+        self.file_list = QListView()
+        self.file_list.setModel(self.file_model)
         self.file_list.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.file_list.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # all rows have the same height, the view only lays out the visible rows
+        self.file_list.setUniformItemSizes(True)
         self.dir_button = QPushButton(QIcon.fromTheme('folder-open'), '', self)
         self.show_hidden_check = QCheckBox(_('Show hidden files'), self)
+        self.sessions_label = QLabel('', self)
 
         # Connects
         self.dir_button.clicked.connect(self.select_dir)
         self.about_action.triggered.connect(self.show_about_dialog)
         self.settings_action.triggered.connect(self.show_settings_dialog)
+        self.library_action.triggered.connect(self.show_library)
+        self.regenerate_action.triggered.connect(self.regenerate_configs)
         self.exit_action.triggered.connect(self.close)
         self.show_hidden_check.stateChanged.connect(self.update_dir)
-        self.file_list.itemDoubleClicked.connect(self.show_file)
+        self.file_list.doubleClicked.connect(self.show_file)
+        self.rp9_viewer.launcher.sessionStarted.connect(self.session_started)
+        self.rp9_viewer.launcher.sessionFinished.connect(self.session_finished)
+        self.file_list.setMouseTracking(True)
+        self.file_list.entered.connect(self.prefetch_around)
+        self.file_list.selectionModel().currentChanged.connect(self.prefetch_around)
+        self.dir_watcher.directoryChanged.connect(self.schedule_refresh)
+        self.dir_watcher.fileChanged.connect(self.schedule_refresh)
+        self.refresh_timer.timeout.connect(self.refresh_dir)
 
         # Layout
         self.setCentralWidget(self.splitter)
@@ -492,11 +1145,22 @@ class MainWindow(QMainWindow):
         left_layout.addWidget(self.show_hidden_check)
 
         self.splitter.addWidget(self.rp9_viewer)
+        self.statusBar().addPermanentWidget(self.sessions_label)
 
         # inital state
+        self.show_hidden_check.blockSignals(True)
         self.show_hidden_check.setChecked(self.config.show_hidden)
+        self.show_hidden_check.blockSignals(False)
         self.file_list.setFocus()
-        self.update_dir()
+        if len(self.current_dir.parts) > 1:
+            self.dir_button.setText(self.current_dir.name)
+        else:
+            self.dir_button.setText(self.current_dir.anchor)
+
+        # the directory is read once the window is shown
+        QTimer.singleShot(0, self.update_dir)
+        # removes what crashed sessions have left in the temp directory
+        cleanup.queue.reclaim(self.config.temp_dir)
 
     @pyqtSlot()
     def update_text(self):
@@ -513,20 +1177,94 @@ class MainWindow(QMainWindow):
         dialog.fsuae_command_edit.setText(self.config.fsuae_command)
         dialog.fsuae_documents_dir_edit.setText(self.config.fsuae_documents_dir)
         dialog.fsuae_rp9_dir_edit.setText(self.config.fsuae_rp9_dir)
+        dialog.media_store_dir_edit.setText(self.config.media_store_dir)
         dialog.temp_dir_edit.setText(self.config.temp_dir)
+        dialog.temp_cache_size_edit.setText(str(self.config.temp_cache_size))
+        dialog.extract_threads_edit.setText(str(self.config.extract_threads))
+        dialog.max_sessions_edit.setText(str(self.config.max_sessions))
         dialog.workbench_135_hd_edit.setText(self.config.workbench_135_hd)
         dialog.workbench_211_hd_edit.setText(self.config.workbench_211_hd)
         dialog.workbench_311_hd_edit.setText(self.config.workbench_311_hd)
+        dialog.incremental_extract_check.setChecked(self.config.incremental_extract)
+        dialog.direct_launch_check.setChecked(self.config.direct_launch)
 
         result = dialog.exec_()
         if result == QDialog.Accepted:
             self.config.fsuae_command = dialog.fsuae_command_edit.text().strip()
             self.config.fsuae_documents_dir = dialog.fsuae_documents_dir_edit.text().strip()
             self.config.fsuae_rp9_dir = dialog.fsuae_rp9_dir_edit.text().strip()
+            self.config.media_store_dir = dialog.media_store_dir_edit.text().strip()
             self.config.temp_dir = dialog.temp_dir_edit.text().strip()
+            try:
+                self.config.temp_cache_size = int(dialog.temp_cache_size_edit.text().strip())
+            except ValueError:
+                self.config.temp_cache_size = 0
+            try:
+                self.config.extract_threads = max(1, int(dialog.extract_threads_edit.text().strip()))
+            except ValueError:
+                self.config.extract_threads = 1
+            try:
+                self.config.max_sessions = max(1, int(dialog.max_sessions_edit.text().strip()))
+            except ValueError:
+                self.config.max_sessions = 1
             self.config.workbench_135_hd = dialog.workbench_135_hd_edit.text().strip()
             self.config.workbench_211_hd = dialog.workbench_211_hd_edit.text().strip()
             self.config.workbench_311_hd = dialog.workbench_311_hd_edit.text().strip()
+            self.config.incremental_extract = dialog.incremental_extract_check.isChecked()
+            self.config.direct_launch = dialog.direct_launch_check.isChecked()
+
+    @pyqtSlot()
+    def regenerate_configs(self):
+        dialog = QProgressDialog(_('Writing configurations...'), _('Cancel'), 0, 1000, self)
+        dialog.setWindowTitle(_('Rewrite all configurations'))
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(500)
+
+        def update_progress(progress):
+            if progress.total > 0:
+                dialog.setValue(int(progress.done * 1000 / progress.total))
+            if progress.member is not None:
+                dialog.setLabelText(progress.member)
+            QApplication.processEvents()
+            if dialog.wasCanceled():
+                progress.cancel()
+
+        try:
+            results = util.regenerate_configs(self.config, util.Rp9Progress(update_progress),
+                                              self.config.extract_threads)
+        except util.Rp9CancelledException:
+            return
+        except util.Rp9UtilException as ex:
+            QMessageBox.critical(self, _('Rewrite all configurations'), str(ex), QMessageBox.Ok)
+            return
+        finally:
+            dialog.close()
+
+        failed = [media_dir.name + ': ' + message for media_dir, config_file, message in results
+                  if config_file is None]
+        message = _('{0} configurations were written.').format(len(results) - len(failed))
+        if failed:
+            message = message + '\n\n' + _('These titles failed:') + '\n' + '\n'.join(failed)
+        QMessageBox.information(self, _('Rewrite all configurations'), message, QMessageBox.Ok)
+
+    @pyqtSlot()
+    def show_library(self):
+        if self.library_window is None:
+            self.library_window = LibraryWindow(self.config, self)
+            self.library_window.openSignal.connect(self.open_library_title)
+        else:
+            self.library_window.refresh()
+        self.library_window.show()
+        self.library_window.raise_()
+        self.library_window.activateWindow()
+
+    @pyqtSlot(str)
+    def open_library_title(self, file):
+        file = Path(file)
+        if file.parent != self.current_dir:
+            self.current_dir = file.parent
+            self.update_dir()
+        self.rp9_viewer.open_rp9(file)
 
     @pyqtSlot()
     def select_dir(self):
@@ -546,32 +1284,114 @@ class MainWindow(QMainWindow):
         else:
             self.dir_button.setText(self.current_dir.anchor)
         self.config.show_hidden = self.show_hidden_check.isChecked()
-        self.file_list.clear()
+        self.file_model.clear(len(self.current_dir.parts) > 1)
+        self.refresh_pending = False
+        self.refresh_timer.stop()
+
+        watched = self.dir_watcher.directories() + self.dir_watcher.files()
+        if watched:
+            self.dir_watcher.removePaths(watched)
+        self.dir_watcher.addPath(str(self.current_dir))
+
+        # scan the directory in the background, entries are added in batches
+        self.cancel_scan()
+        self.scan_id = self.scan_id + 1
+        worker = DirectoryScanWorker(self.scan_id, self.current_dir, self.config.show_hidden)
+        worker.entriesSignal.connect(self.add_entries)
+        self.start_scan(worker, worker.execute)
+
+    def start_scan(self, worker, execute):
+        thread = QThread()
+        thread.started.connect(execute)
+        worker.moveToThread(thread)
+        worker.exitSignal.connect(self.scan_finished)
+        worker.exitSignal.connect(thread.quit)
+        thread.finished.connect(self.scan_thread_finished)
+        self.scan_worker = worker
+        self.scan_threads.append((thread, worker))
+        thread.start()
+
+    def cancel_scan(self):
+        if self.scan_worker is not None:
+            self.scan_worker.cancel()
+            self.scan_worker = None
+
+    @pyqtSlot(int)
+    def scan_finished(self, scan_id):
+        if scan_id == self.scan_id:
+            self.scan_worker = None
+            if self.refresh_pending:
+                self.refresh_dir()
 
-        folders = []
-        files = []
-        for path in self.current_dir.iterdir():
-            if not path.name.startswith('.') or self.config.show_hidden:
-                if path.is_dir():
-                    folders.append(path.name)
-                elif path.is_file():
-                    if path.name.lower().endswith('.rp9') and is_zipfile(str(path)):
-                        files.append(path.name)
+    @pyqtSlot()
+    def scan_thread_finished(self):
+        self.scan_threads = [(thread, worker) for thread, worker in self.scan_threads if thread.isRunning()]
 
-        if len(self.current_dir.parts) > 1:
-            self.file_list.addItem(QListWidgetItem(QIcon.fromTheme('folder'), '..'))
-
-        folders.sort(key=str.lower)
-        for fol in folders:
-            self.file_list.addItem(QListWidgetItem(QIcon.fromTheme('folder'), fol))
-        files.sort(key=str.lower)
-        for fil in files:
-            self.file_list.addItem(
-                QListWidgetItem(QIcon.fromTheme('fs-uae', QIcon.fromTheme('package-x-generic')), fil))
-
-    @pyqtSlot(QListWidgetItem)
-    def show_file(self, item):
-        name = item.text()
+    @pyqtSlot(int, list, list)
+    def add_entries(self, scan_id, folders, files):
+        if scan_id != self.scan_id:
+            return
+
+        self.file_model.add(folders, files)
+
+    @pyqtSlot(str)
+    def schedule_refresh(self, path):
+        # a copy of many files sends a burst of notifications, they are handled together
+        self.refresh_timer.start()
+
+    @pyqtSlot()
+    def refresh_dir(self):
+        if self.scan_worker is not None:
+            # the entries of the running scan are not complete yet
+            self.refresh_pending = True
+            return
+        self.refresh_pending = False
+
+        # the directory is read in the background, only the difference is applied to the list
+        self.scan_id = self.scan_id + 1
+        worker = DirectoryScanWorker(self.scan_id, self.current_dir, self.config.show_hidden,
+                                     known_files=self.file_model.file_names())
+        worker.refreshSignal.connect(self.apply_refresh)
+        self.start_scan(worker, worker.refresh)
+
+    @pyqtSlot(int, list, list, list)
+    def apply_refresh(self, scan_id, folders, files, incomplete):
+        if scan_id != self.scan_id:
+            return
+
+        folders = set(folders)
+        files = set(files)
+        known_folders = self.file_model.folder_names()
+        known_files = self.file_model.file_names()
+        self.file_model.remove(known_folders - folders, known_files - files)
+
+        # files still being copied are watched until they are complete
+        incomplete = set(incomplete)
+        watched = set(self.dir_watcher.files())
+        if watched - incomplete:
+            self.dir_watcher.removePaths(list(watched - incomplete))
+        if incomplete - watched:
+            self.dir_watcher.addPaths(list(incomplete - watched))
+
+        self.add_entries(scan_id, sorted(folders - known_folders), sorted(files - known_files))
+
+    @pyqtSlot(QModelIndex)
+    def prefetch_around(self, index):
+        if not index.isValid():
+            return
+
+        # the nearest files first
+        row = index.row()
+        files = []
+        for distance in range(PREFETCH_DISTANCE + 1):
+            for neighbour in sorted(set([row - distance, row + distance])):
+                if self.file_model.is_file(neighbour):
+                    files.append(self.current_dir.joinpath(self.file_model.name(neighbour)))
+        self.rp9_viewer.prefetch(files)
+
+    @pyqtSlot(QModelIndex)
+    def show_file(self, index):
+        name = self.file_model.name(index.row())
         if name == '..':
             self.current_dir = self.current_dir.parent
             self.update_dir()
@@ -583,11 +1403,55 @@ class MainWindow(QMainWindow):
             elif file.is_file():
                 self.rp9_viewer.open_rp9(file)
 
+    @pyqtSlot(object)
+    def session_started(self, session):
+        self.update_sessions()
+        self.statusBar().showMessage(_('Started fs-uae: {0}').format(session.title), 5000)
+
+    @pyqtSlot(object)
+    def session_finished(self, session):
+        self.update_sessions()
+        if session.state == rp9qt.SESSION_FAILED:
+            QMessageBox.critical(self, _('Run rp9'), _('Could not start fs-uae: {0}').format(session.error),
+                                 QMessageBox.Ok)
+        elif session.state == rp9qt.SESSION_CRASHED:
+            self.statusBar().showMessage(_('fs-uae crashed: {0}').format(session.title))
+        elif session.exit_code != 0:
+            self.statusBar().showMessage(_('fs-uae exited with code {0}: {1}').format(session.exit_code,
+                                                                                      session.title))
+        else:
+            self.statusBar().showMessage(_('fs-uae finished: {0}').format(session.title), 5000)
+
+    def update_sessions(self):
+        count = len(self.rp9_viewer.launcher.sessions)
+        self.sessions_label.setText(_('Running fs-uae processes: {0}').format(count) if count > 0 else '')
+
     def closeEvent(self, event):
+        sessions = self.rp9_viewer.launcher.running()
+        if sessions:
+            choice = QMessageBox.question(self, _('Quit'),
+                                          _('{0} fs-uae processes are still running. Quit and end them?').format(
+                                              len(sessions)),
+                                          QMessageBox.Yes | QMessageBox.No)
+            if choice != QMessageBox.Yes:
+                event.ignore()
+                return
+
         self.config.mainwindow_witdh = self.width()
         self.config.mainwindow_height = self.height()
         self.config.mainwindow_x = self.x()
         self.config.mainwindow_y = self.y()
         self.config.save()
+        self.rp9_viewer.close_archives()
+        self.rp9_viewer.launcher.shutdown()
+        if self.library_window is not None:
+            self.library_window.close()
+
+        self.refresh_timer.stop()
+        self.cancel_scan()
+        for thread, worker in self.scan_threads:
+            # the queued quit of the worker is not delivered while waiting here
+            thread.quit()
+            thread.wait()
 
         super(MainWindow, self).closeEvent(event)
@@ -4,16 +4,30 @@
 # rp9UnpAckEr main file
 #
 
+import time
+
+# start of the time to the first window, before the modules are loaded
+STARTED = time.perf_counter()
+
 import gui
+import metrics
 import sys
 
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QApplication
 
 
+def report_startup():
+    if metrics.registry.enabled:
+        metrics.registry.record('startup', time.perf_counter() - STARTED)
+
+
 def main(argv):
     app = QApplication(argv)
     mainwindow = gui.MainWindow()
     mainwindow.show()
+    # runs when the event loop has processed the show event, close to the first paint of the window
+    QTimer.singleShot(0, report_startup)
     sys.exit(app.exec_())
 
 
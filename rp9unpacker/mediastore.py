@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Content addressed store for extracted media files
+#
+
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import traceback
+
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request to clone the extents of a file (linux, btrfs / xfs)
+FICLONE = 0x40049409
+
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+class MediaStore:
+    """Media files keyed by the CRC32 and size of the zip entry.
+
+    The key is all that identifies the content, the SHA-256 kept next to an object only detects changes of the object
+    itself. A key added again with a different SHA-256 stands for two different files, it is marked ambiguous and
+    not used from then on.
+
+    Extracted media is reflinked into the title directories where the file system supports it. Hardlinks are used
+    only where the caller allows it, because FS-UAE writes to hard disk images and a write through a hardlink would
+    change every title sharing the file. A store object changed anyway fails the hash check and is dropped.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def object_path(self, crc, size):
+        return self.directory.joinpath(format(crc, '08x') + '-' + str(size))
+
+    def link(self, crc, size, target, hardlink=False):
+        path = self.object_path(crc, size)
+        if self.__is_ambiguous(path) or not self.__verify(path, size):
+            return False
+
+        if self.__reflink(path, target):
+            return True
+        if hardlink and self.__hardlink(path, target):
+            return True
+        shutil.copyfile(str(path), str(target))
+        return True
+
+    def add(self, crc, size, source, digest, hardlink=False):
+        if not self.directory.is_dir():
+            self.directory.mkdir(parents=True)
+
+        path = self.object_path(crc, size)
+        if self.__is_ambiguous(path):
+            return
+
+        temp = path.with_name(path.name + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp')
+        try:
+            if not self.__reflink(source, temp) and not (hardlink and self.__hardlink(source, temp)):
+                shutil.copyfile(str(source), str(temp))
+
+            # the digest outlives a dropped object, a different one means another file with the same key
+            known = self.__read_digest(path)
+            if known is not None and known[0] != digest:
+                sys.stderr.write('Different media files with the same CRC32 and size, not storing them: \'' +
+                                 str(path) + '\'\n')
+                self.__mark_ambiguous(path)
+                self.__unlink(temp)
+                return
+
+            os.replace(str(temp), str(path))
+            self.__write_digest(path, digest)
+        except OSError:
+            sys.stderr.write('Could not add media file to store: \'' + str(path) + '\'\n')
+            traceback.print_exc(file=sys.stderr)
+            self.__unlink(temp)
+
+    def __verify(self, path, size):
+        known = self.__read_digest(path)
+        try:
+            stat = os.stat(str(path))
+        except OSError:
+            return False
+        if known is None:
+            return False
+        digest, mtime = known
+
+        if stat.st_size != size:
+            self.__unlink(path)
+            return False
+
+        # only hash the object again when it was modified since the digest was written
+        if str(stat.st_mtime_ns) == mtime:
+            return True
+        if file_digest(path) == digest:
+            self.__write_digest(path, digest)
+            return True
+
+        sys.stderr.write('Media file in store was modified, removing it: \'' + str(path) + '\'\n')
+        self.__unlink(path)
+        return False
+
+    @staticmethod
+    def __read_digest(path):
+        try:
+            with open(str(path.with_name(path.name + '.sha256'))) as file:
+                digest, mtime = file.read().split()
+        except (OSError, ValueError):
+            return None
+        return digest, mtime
+
+    def __write_digest(self, path, digest):
+        mtime = os.stat(str(path)).st_mtime_ns
+        with open(str(path.with_name(path.name + '.sha256')), 'w') as file:
+            file.write(digest + ' ' + str(mtime) + '\n')
+
+    def __mark_ambiguous(self, path):
+        self.__unlink(path)
+        try:
+            path.with_name(path.name + '.ambiguous').touch()
+        except OSError:
+            sys.stderr.write('Could not mark media file in store as ambiguous: \'' + str(path) + '\'\n')
+            traceback.print_exc(file=sys.stderr)
+
+    @staticmethod
+    def __is_ambiguous(path):
+        return path.with_name(path.name + '.ambiguous').exists()
+
+    @staticmethod
+    def __unlink(path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    @staticmethod
+    def __reflink(source, target):
+        if fcntl is None:
+            return False
+        try:
+            with open(str(source), 'rb') as src, open(str(target), 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return True
+        except OSError:
+            MediaStore.__unlink(Path(target))
+            return False
+
+    @staticmethod
+    def __hardlink(source, target):
+        try:
+            os.link(str(source), str(target))
+            return True
+        except OSError:
+            return False
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(str(path), 'rb') as file:
+        while True:
+            chunk = file.read(HASH_BUFFER_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
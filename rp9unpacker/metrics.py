@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Timing of the processing phases
+#
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+
+from contextlib import contextmanager
+
+ENVIRONMENT_VARIABLE = 'RP9UNPACKER_METRICS'
+
+
+class MetricsPhase:
+    def __init__(self):
+        self.byte_count = 0
+
+    def add_bytes(self, count):
+        self.byte_count = self.byte_count + count
+
+
+class Metrics:
+    """Durations and byte counts per phase, dumped as json or in the prometheus text format."""
+
+    def __init__(self):
+        self.enabled = False
+        self.file = None
+        self.__lock = threading.Lock()
+        self.__phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        phase = MetricsPhase()
+        if not self.enabled:
+            yield phase
+            return
+
+        started = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            self.record(name, time.perf_counter() - started, phase.byte_count)
+
+    def record(self, name, seconds, byte_count=0):
+        with self.__lock:
+            values = self.__phases.get(name)
+            if values is None:
+                values = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'bytes': 0}
+                self.__phases[name] = values
+            values['count'] = values['count'] + 1
+            values['seconds'] = values['seconds'] + seconds
+            values['max_seconds'] = max(values['max_seconds'], seconds)
+            values['bytes'] = values['bytes'] + byte_count
+
+    def snapshot(self):
+        with self.__lock:
+            return {name: dict(values) for name, values in self.__phases.items()}
+
+    def merge(self, phases):
+        with self.__lock:
+            for name, other in phases.items():
+                values = self.__phases.get(name)
+                if values is None:
+                    self.__phases[name] = dict(other)
+                else:
+                    values['count'] = values['count'] + other['count']
+                    values['seconds'] = values['seconds'] + other['seconds']
+                    values['max_seconds'] = max(values['max_seconds'], other['max_seconds'])
+                    values['bytes'] = values['bytes'] + other['bytes']
+
+    def reset(self):
+        with self.__lock:
+            self.__phases.clear()
+
+    def to_json(self):
+        return json.dumps({'phases': self.snapshot()}, indent=4, sort_keys=True)
+
+    def to_prometheus(self):
+        phases = sorted(self.snapshot().items())
+        lines = [
+            '# HELP rp9unpacker_phase_seconds Time spent in a processing phase.',
+            '# TYPE rp9unpacker_phase_seconds summary',
+        ]
+        for name, values in phases:
+            lines.append('rp9unpacker_phase_seconds_sum{phase="' + name + '"} ' + repr(values['seconds']))
+            lines.append('rp9unpacker_phase_seconds_count{phase="' + name + '"} ' + str(values['count']))
+        lines.append('# HELP rp9unpacker_phase_max_seconds Longest single run of a processing phase.')
+        lines.append('# TYPE rp9unpacker_phase_max_seconds gauge')
+        for name, values in phases:
+            lines.append('rp9unpacker_phase_max_seconds{phase="' + name + '"} ' + repr(values['max_seconds']))
+        lines.append('# HELP rp9unpacker_phase_bytes_total Bytes processed in a processing phase.')
+        lines.append('# TYPE rp9unpacker_phase_bytes_total counter')
+        for name, values in phases:
+            lines.append('rp9unpacker_phase_bytes_total{phase="' + name + '"} ' + str(values['bytes']))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, file=None):
+        file = self.file if file is None else file
+        if file is None:
+            return
+
+        try:
+            data = self.to_json() if str(file).lower().endswith('.json') else self.to_prometheus()
+            with open(str(file), 'w') as outfile:
+                outfile.write(data)
+        except Exception:
+            sys.stderr.write('Could not write metrics file: \'' + str(file) + '\'\n')
+            traceback.print_exc(file=sys.stderr)
+
+
+registry = Metrics()
+
+
+def phase(name):
+    return registry.phase(name)
+
+
+def configure(config=None):
+    """Enables the metrics if a file is set in the environment or the config, they are written at exit."""
+    file = os.environ.get(ENVIRONMENT_VARIABLE)
+    if not file and config is not None:
+        file = config.metrics_file
+    if not file:
+        return False
+
+    if registry.file is None:
+        atexit.register(registry.dump)
+    registry.file = file
+    registry.enabled = True
+    return True
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Persistent index of parsed rp9 manifests
+#
+
+import os
+import sqlite3
+import threading
+
+from pathlib import Path
+
+SCHEMA_VERSION = 2
+
+INFO_FIELDS = [
+    'description_title',
+    'description_publisher',
+    'description_type',
+    'description_genre',
+    'description_year',
+    'description_language',
+    'description_rating',
+    'description_systemrom',
+    'configuration_system',
+    'configuration_floppy_count',
+    'configuration_silent_drives',
+    'configuration_turbo_floppy',
+    'configuration_hdf_boot',
+    'configuration_chip_ram',
+    'configuration_fast_ram',
+    'configuration_z3_ram',
+    'configuration_cpu',
+    'configuration_jit',
+]
+
+BOOLEAN_FIELDS = [
+    'configuration_silent_drives',
+    'configuration_turbo_floppy',
+    'configuration_jit',
+]
+
+
+# columns of the library view, the media types are collected from the media table
+LIBRARY_FIELDS = [
+    'description_title',
+    'description_publisher',
+    'description_genre',
+    'description_year',
+    'configuration_system',
+    'media_types',
+]
+
+FACET_FIELDS = [
+    'description_genre',
+    'description_year',
+    'description_publisher',
+    'configuration_system',
+    'media_type',
+]
+
+
+def default_index_file():
+    return Path.home().joinpath('.rp9unpacker-index.db')
+
+
+class Rp9IndexEntry:
+    def __init__(self):
+        self.fields = {}
+        self.media = []
+        self.help = []
+        self.images = []
+
+
+class Rp9Index:
+
+    def __init__(self, file=None):
+        self.file = default_index_file() if file is None else Path(file)
+        self.__local = threading.local()
+        self.__pid = os.getpid()
+
+    def __connection(self):
+        # connections must neither be shared between threads nor survive a fork
+        if self.__pid != os.getpid():
+            self.__local = threading.local()
+            self.__pid = os.getpid()
+
+        connection = getattr(self.__local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(str(self.file), timeout=10)
+            self.__create_schema(connection)
+            self.__local.connection = connection
+        return connection
+
+    @staticmethod
+    def __create_schema(connection):
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if version == SCHEMA_VERSION:
+            return
+
+        # the schema is created once the database is locked, another connection may have been first
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            if connection.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION:
+                return
+            connection.execute('DROP TABLE IF EXISTS manifest')
+            connection.execute('DROP TABLE IF EXISTS media')
+            connection.execute('DROP TABLE IF EXISTS extras')
+            connection.execute('CREATE TABLE manifest (path TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                               'mtime INTEGER NOT NULL, ' + ', '.join(INFO_FIELDS) + ')')
+            connection.execute('CREATE TABLE media (path TEXT NOT NULL, position INTEGER NOT NULL, '
+                               'type TEXT, priority TEXT, name TEXT)')
+            connection.execute('CREATE TABLE extras (path TEXT NOT NULL, position INTEGER NOT NULL, '
+                               'kind TEXT NOT NULL, priority TEXT, name TEXT)')
+            connection.execute('CREATE INDEX media_path ON media (path)')
+            connection.execute('CREATE INDEX media_type ON media (type, path)')
+            connection.execute('CREATE INDEX extras_path ON extras (path)')
+            for field in FACET_FIELDS:
+                if field in INFO_FIELDS:
+                    connection.execute('CREATE INDEX manifest_' + field + ' ON manifest (' + field + ')')
+            connection.execute('CREATE INDEX manifest_title ON manifest (description_title COLLATE NOCASE)')
+            connection.execute('PRAGMA user_version = ' + str(SCHEMA_VERSION))
+
+    @staticmethod
+    def key(file):
+        return os.path.abspath(str(file))
+
+    def lookup(self, file, size, mtime):
+        connection = self.__connection()
+        path = self.key(file)
+
+        row = connection.execute('SELECT ' + ', '.join(INFO_FIELDS) + ' FROM manifest '
+                                 'WHERE path = ? AND size = ? AND mtime = ?', (path, size, mtime)).fetchone()
+        if row is None:
+            return None
+
+        entry = Rp9IndexEntry()
+        for i in range(len(INFO_FIELDS)):
+            value = row[i]
+            if INFO_FIELDS[i] in BOOLEAN_FIELDS:
+                value = bool(value)
+            entry.fields[INFO_FIELDS[i]] = value
+
+        for media_type, priority, name in connection.execute(
+                'SELECT type, priority, name FROM media WHERE path = ? ORDER BY position', (path,)):
+            entry.media.append((media_type, priority, name))
+
+        for kind, priority, name in connection.execute(
+                'SELECT kind, priority, name FROM extras WHERE path = ? ORDER BY position', (path,)):
+            if kind == 'help':
+                entry.help.append((priority, name))
+            else:
+                entry.images.append((priority, name))
+
+        return entry
+
+    def store(self, file, size, mtime, entry):
+        connection = self.__connection()
+        path = self.key(file)
+
+        with connection:
+            self.__delete(connection, path)
+            values = [path, size, mtime] + [entry.fields.get(field) for field in INFO_FIELDS]
+            connection.execute('INSERT INTO manifest VALUES (' + ', '.join('?' * len(values)) + ')', values)
+            connection.executemany('INSERT INTO media VALUES (?, ?, ?, ?, ?)',
+                                   [(path, i) + tuple(entry.media[i]) for i in range(len(entry.media))])
+            connection.executemany('INSERT INTO extras VALUES (?, ?, ?, ?, ?)',
+                                   [(path, i, 'help') + tuple(entry.help[i]) for i in range(len(entry.help))])
+            connection.executemany('INSERT INTO extras VALUES (?, ?, ?, ?, ?)',
+                                   [(path, i, 'image') + tuple(entry.images[i]) for i in range(len(entry.images))])
+
+    def library(self, filters=None, text=None, order='description_title', descending=False):
+        """Returns the path and the library fields of all titles matching the filters."""
+        where, parameters = self.__where(filters, text)
+        media_types = '(SELECT GROUP_CONCAT(type, \', \') FROM (SELECT DISTINCT type FROM media ' \
+                      'WHERE media.path = manifest.path ORDER BY type))'
+        columns = [media_types + ' AS media_types' if field == 'media_types' else field for field in LIBRARY_FIELDS]
+        if order not in LIBRARY_FIELDS:
+            order = 'description_title'
+        sort = 'media_types' if order == 'media_types' else order + ' COLLATE NOCASE'
+        direction = ' DESC' if descending else ''
+        return self.__connection().execute(
+            'SELECT path, ' + ', '.join(columns) + ' FROM manifest' + where +
+            ' ORDER BY ' + sort + direction + ', path' + direction, parameters).fetchall()
+
+    def facet(self, field, filters=None, text=None):
+        """Returns the values of a facet field with the number of titles, the other filters are applied."""
+        others = dict((key, value) for key, value in (filters or {}).items() if key != field)
+        where, parameters = self.__where(others, text)
+        if field == 'media_type':
+            return self.__connection().execute(
+                'SELECT type, COUNT(DISTINCT path) FROM media WHERE path IN (SELECT path FROM manifest' + where +
+                ') GROUP BY type ORDER BY type', parameters).fetchall()
+        if field not in FACET_FIELDS:
+            raise ValueError('Unknown facet: ' + field)
+        return self.__connection().execute(
+            'SELECT ' + field + ', COUNT(*) FROM manifest' + where + ' GROUP BY ' + field +
+            ' ORDER BY ' + field + ' COLLATE NOCASE', parameters).fetchall()
+
+    def paths(self, directory=None):
+        connection = self.__connection()
+        if directory is None:
+            return [row[0] for row in connection.execute('SELECT path FROM manifest')]
+        prefix = os.path.join(self.key(directory), '')
+        return [row[0] for row in connection.execute(
+            'SELECT path FROM manifest WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))]
+
+    @staticmethod
+    def __where(filters, text):
+        conditions = []
+        parameters = []
+        for field, value in sorted((filters or {}).items()):
+            if field == 'media_type':
+                conditions.append('path IN (SELECT path FROM media WHERE type = ?)')
+            elif field in FACET_FIELDS:
+                conditions.append(field + ' IS ?')
+            else:
+                raise ValueError('Unknown facet: ' + field)
+            parameters.append(value)
+        if text:
+            conditions.append('description_title LIKE ? ESCAPE \'\\\'')
+            parameters.append('%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if not conditions:
+            return '', parameters
+        return ' WHERE ' + ' AND '.join(conditions), parameters
+
+    def remove(self, file):
+        connection = self.__connection()
+        with connection:
+            self.__delete(connection, self.key(file))
+
+    @staticmethod
+    def __delete(connection, path):
+        connection.execute('DELETE FROM manifest WHERE path = ?', (path,))
+        connection.execute('DELETE FROM media WHERE path = ?', (path,))
+        connection.execute('DELETE FROM extras WHERE path = ?', (path,))
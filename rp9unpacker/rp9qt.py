@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Qt adapter of the rp9 handling
+#
+
+import metrics
+import rp9util as util
+
+import sys
+import time
+import traceback
+
+from PyQt5.QtCore import pyqtSignal, QBuffer, QByteArray, QIODevice, QObject, QProcess, Qt
+from PyQt5.QtGui import QImage
+
+SESSION_RUNNING = 'running'
+SESSION_FINISHED = 'finished'
+SESSION_CRASHED = 'crashed'
+SESSION_FAILED = 'failed'
+
+
+class Rp9Session:
+    """One FS-UAE process started by the launcher."""
+
+    def __init__(self, session_id, title, process):
+        self.id = session_id
+        self.title = title
+        self.process = process
+        self.qprocess = None
+        self.state = SESSION_RUNNING
+        self.exit_code = None
+        self.error = None
+        self.started = time.perf_counter()
+        self.duration = 0.0
+
+
+class Rp9Launcher(QObject):
+    """Runs several FS-UAE processes at once, the event loop is notified when one has finished."""
+
+    sessionStarted = pyqtSignal(object)
+    sessionFinished = pyqtSignal(object)
+
+    def __init__(self, max_sessions=4, parent=None):
+        super().__init__(parent)
+
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.__next_id = 1
+
+    def can_start(self):
+        return len(self.sessions) < max(1, self.max_sessions)
+
+    def running(self):
+        return list(self.sessions.values())
+
+    def start(self, process, title=None):
+        if not self.can_start():
+            process.cleanup()
+            return None
+
+        session = Rp9Session(self.__next_id, title, process)
+        self.__next_id = self.__next_id + 1
+
+        qprocess = QProcess(self)
+        # the output of FS-UAE goes to the terminal, like before
+        qprocess.setProcessChannelMode(QProcess.ForwardedChannels)
+        qprocess.finished.connect(lambda code, status: self.__finished(session, code, status))
+        qprocess.errorOccurred.connect(lambda error: self.__error(session, error))
+        session.qprocess = qprocess
+        self.sessions[session.id] = session
+
+        command = process.command_line()
+        qprocess.start(command[0], command[1:])
+        if session.id in self.sessions:
+            self.sessionStarted.emit(session)
+        return session
+
+    def shutdown(self):
+        for session in self.running():
+            session.qprocess.terminate()
+            if not session.qprocess.waitForFinished(3000):
+                session.qprocess.kill()
+                session.qprocess.waitForFinished(1000)
+
+    def __finished(self, session, code, status):
+        if status == QProcess.CrashExit:
+            session.state = SESSION_CRASHED
+        else:
+            session.state = SESSION_FINISHED
+        session.exit_code = code
+        self.__end(session)
+
+    def __error(self, session, error):
+        # a crash is followed by the finished signal, only a failed start ends the session here
+        if error == QProcess.FailedToStart:
+            session.state = SESSION_FAILED
+            session.error = session.qprocess.errorString()
+            self.__end(session)
+
+    def __end(self, session):
+        if self.sessions.pop(session.id, None) is None:
+            return
+        session.duration = time.perf_counter() - session.started
+        if metrics.registry.enabled:
+            metrics.registry.record('fsuae_run', session.duration)
+        session.qprocess.deleteLater()
+        session.qprocess = None
+        try:
+            session.process.cleanup()
+        except Exception:
+            sys.stderr.write('Could not clean up after FS-UAE: \'' + str(session.process.config_file) + '\'\n')
+            traceback.print_exc(file=sys.stderr)
+        self.sessionFinished.emit(session)
+
+
+class QtImageCodec:
+    """Decodes the embedded images to thumbnails as QImage, the thumbnail cache stores them as png."""
+
+    @staticmethod
+    def thumbnail(data, size):
+        image = QImage.fromData(data)
+        if image.isNull():
+            return None
+        if image.width() > size or image.height() > size:
+            return image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        return image
+
+    @staticmethod
+    def load(data):
+        image = QImage()
+        if image.loadFromData(data):
+            return image
+        return None
+
+    @staticmethod
+    def save(image, image_format='PNG'):
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.WriteOnly)
+        image.save(buffer, image_format)
+        buffer.close()
+        return bytes(data)
+
+    @staticmethod
+    def downscale(data, size, image_format):
+        image = QImage.fromData(data)
+        if image.isNull() or (image.width() <= size and image.height() <= size):
+            return None
+        return QtImageCodec.save(image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation),
+                                 image_format)
+
+
+def install():
+    util.image_codec = QtImageCodec()
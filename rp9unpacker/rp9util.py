@@ -4,29 +4,130 @@
 # Utilities for rp9 file handling
 #
 
+import cleanup
 import gettext
+import hashlib
+import metrics
 import os
 import sys
 import traceback
 import io
 import subprocess
+import threading
+import zlib
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from pathlib import Path
+from cache import ExtractionCache, ThumbnailCache, LOCK_FILE, member_path, read_extraction_state, \
+    write_extraction_state
+from mediastore import MediaStore
+from rp9index import Rp9Index, Rp9IndexEntry, INFO_FIELDS
 from xml.etree import ElementTree
-from zipfile import ZipFile
-from PyQt5.QtCore import QObject, pyqtSlot, pyqtSignal
-from PyQt5.QtGui import QImage
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED
 
 localedir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'locales')
 translate = gettext.translation('rp9util', localedir, fallback=True)
 _ = translate.gettext
 
+THUMBNAIL_SIZE = 160
+COPY_BUFFER_SIZE = 1024 * 1024
+# all-zero blocks of hard disk images are not written, they stay holes in the extracted file
+SPARSE_BLOCK_SIZE = 64 * 1024
+ZERO_BLOCK = bytes(SPARSE_BLOCK_SIZE)
+# larger preview images are scaled down by optimize()
+OPTIMIZE_PREVIEW_SIZE = 640
+OPTIMIZE_IMAGE_FORMATS = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG'}
+DIRECT_LAUNCH_EXTENSIONS = ('.adf', '.adz', '.dms', '.ipf')
+
+# set to None to parse the manifests without the persistent index
+manifest_index = Rp9Index()
+
+# set to None to decode the embedded images without the persistent cache
+thumbnail_cache = ThumbnailCache()
+
+# decodes and scales the embedded images, set by the gui (see rp9qt), without it no images are loaded
+image_codec = None
+
 
 class Rp9UtilException(Exception):
     def __init__(self, *args, **kwargs):
         Exception.__init__(self, *args, **kwargs)
 
 
+class Rp9CancelledException(Rp9UtilException):
+    def __init__(self, *args, **kwargs):
+        Rp9UtilException.__init__(self, *args, **kwargs)
+
+
+class Rp9Progress:
+    """Progress of an extraction, the callback is called with this object after every copied chunk."""
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.member = None
+        self.member_done = 0
+        self.member_total = 0
+        self.done = 0
+        self.total = 0
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def start(self, total):
+        self.done = 0
+        self.total = total
+        self.update()
+
+    def start_member(self, name, total):
+        self.member = name
+        self.member_done = 0
+        self.member_total = total
+        self.update()
+
+    def advance(self, count):
+        self.member_done = self.member_done + count
+        self.done = self.done + count
+        self.update()
+
+    def update(self):
+        if self.callback is not None:
+            self.callback(self)
+        if self.cancelled:
+            raise Rp9CancelledException(_('The extraction was cancelled!'))
+
+
+class Rp9WorkerProgress:
+    """Progress of one extraction thread, the callback of the shared progress is only called by the main thread."""
+
+    def __init__(self, progress, lock, abort):
+        self.progress = progress
+        self.lock = lock
+        self.abort = abort
+        self.member = None
+
+    def start_member(self, name, total):
+        with self.lock:
+            self.member = name
+            self.progress.member = name
+            self.progress.member_done = 0
+            self.progress.member_total = total
+        self.check()
+
+    def advance(self, count):
+        with self.lock:
+            if self.progress.member == self.member:
+                self.progress.member_done = self.progress.member_done + count
+            self.progress.done = self.progress.done + count
+        self.check()
+
+    def check(self):
+        if self.progress.cancelled or self.abort.is_set():
+            raise Rp9CancelledException(_('The extraction was cancelled!'))
+
+
 class Rp9Media:
     def __init__(self):
         self.type = None
@@ -35,17 +136,57 @@ class Rp9Media:
 
 
 class Rp9Help:
+    """An embedded help document, the text is read from the archive when it is first used."""
+
     def __init__(self):
         self.priority = None
         self.name = None
-        self.text = None
+        self.archive = None
+        self.loaded = False
+        self.__text = None
+
+    @property
+    def text(self):
+        if not self.loaded and self.archive is not None:
+            self.__text = read_help(self.archive, self.name)
+            self.loaded = True
+        return self.__text
+
+    @text.setter
+    def text(self, text):
+        self.__text = text
+        self.loaded = True
 
 
 class Rp9Image:
+    """An embedded image, it is decoded and scaled to a thumbnail when it is first used."""
+
     def __init__(self):
         self.priority = None
         self.name = None
-        self.image = None
+        self.archive = None
+        self.loaded = False
+        self.__image = None
+
+    @property
+    def image(self):
+        if not self.loaded and self.archive is not None:
+            self.__image = read_image(self.archive, self.name)
+            self.loaded = True
+        return self.__image
+
+    @image.setter
+    def image(self, image):
+        self.__image = image
+        self.loaded = True
+
+
+class Rp9ExtractReport:
+    def __init__(self):
+        self.added = []
+        self.updated = []
+        self.unchanged = []
+        self.modified = []
 
 
 class Rp9Info:
@@ -73,54 +214,310 @@ class Rp9Info:
         self.embedded_images = []
 
 
-class Rp9ProcessWorker(QObject):
-    exitSignal = pyqtSignal()
-
-    def __init__(self, com, cfile, rem):
-        super().__init__()
+class Rp9Process:
+    """A FS-UAE run, the temporary files are removed when the process has finished."""
 
+    def __init__(self, com, cfile, rem, args=None, lock=None, report=None):
         self.command = com
         self.config_file = cfile
         self.remove_dir = rem
+        self.arguments = [str(cfile)] if args is None else args
+        self.lock_file = lock
+        self.report = report
+
+    def command_line(self):
+        return [str(self.command)] + self.arguments
 
-    @pyqtSlot()
     def execute(self):
-        subprocess.run([str(self.command), str(self.config_file)])
+        with metrics.phase('fsuae_run'):
+            subprocess.run(self.command_line())
+        self.cleanup()
 
-        if self.remove_dir is not None and self.remove_dir.is_dir():
+    def cleanup(self):
+        if self.lock_file is not None:
             try:
-                self.__delete_dir(self.remove_dir)
-            except Exception:
-                sys.stderr.write('Could not delete temporary directory: \'' + str(self.remove_dir) + '\'\n')
-                traceback.print_exc(file=sys.stderr)
+                self.lock_file.unlink()
+            except OSError:
+                pass  # ignore
 
-        self.exitSignal.emit()
+        if self.remove_dir is not None:
+            # renamed away at once, the files are deleted in the background
+            cleanup.queue.remove(self.remove_dir)
 
-    def __delete_dir(self, path):
-        for sub in path.iterdir():
-            if sub.is_dir():
-                self.__delete_dir(sub)
-            else:
-                sub.unlink()
-        path.rmdir()
+
+class Rp9Archive:
+    """A session on one rp9 file, the zip file is opened at most once and the manifest is parsed at most once."""
+
+    def __init__(self, file):
+        self.file = Path(file)
+        self.zipfile = None
+        self.info = None
+        self.extras_loaded = False
+        self.__stat = None
+        self.__lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self):
+        with self.__lock:
+            if self.zipfile is None:
+                self.zipfile = ZipFile(str(self.file))
+            return self.zipfile
+
+    def close(self):
+        with self.__lock:
+            if self.zipfile is not None:
+                self.zipfile.close()
+                self.zipfile = None
+
+    def stat(self):
+        if self.__stat is None:
+            self.__stat = os.stat(str(self.file))
+        return self.__stat
+
+    def is_modified(self):
+        if self.__stat is None:
+            return False
+        try:
+            current = os.stat(str(self.file))
+        except OSError:
+            return True
+        return current.st_size != self.__stat.st_size or current.st_mtime_ns != self.__stat.st_mtime_ns
+
+    def get_info(self, load_extras=False):
+        return get_info(self, load_extras)
+
+    def load_extras(self):
+        return get_info(self, True)
+
+    def is_already_extracted(self, config):
+        return is_already_extracted(self, config)
+
+    def extract(self, config, override=False, progress=None):
+        return extract(self, config, override, progress)
+
+    def write_config(self, config, override=False):
+        return write_config(self, config, override)
+
+    def run(self, config, temporary, override=False, progress=None):
+        return run(self, config, temporary, override, progress)
+
+
+class Rp9ArchivePool:
+    """Keeps the sessions of the recently used rp9 files open."""
+
+    def __init__(self, size=8):
+        self.size = size
+        self.__archives = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, file):
+        key = str(file)
+        with self.__lock:
+            archive = self.__archives.pop(key, None)
+            if archive is not None and archive.is_modified():
+                archive.close()
+                archive = None
+            if archive is None:
+                archive = Rp9Archive(file)
+
+            self.__archives[key] = archive
+            self.__evict()
+            return archive
+
+    def add(self, archive):
+        """Adds a session opened elsewhere, a session already in the pool is kept."""
+        key = str(archive.file)
+        with self.__lock:
+            if key in self.__archives:
+                archive.close()
+                return False
+
+            self.__archives[key] = archive
+            self.__evict()
+            return True
+
+    def contains(self, file):
+        with self.__lock:
+            archive = self.__archives.get(str(file))
+        return archive is not None and archive.info is not None and not archive.is_modified()
+
+    def close(self):
+        with self.__lock:
+            for archive in self.__archives.values():
+                archive.close()
+            self.__archives.clear()
+
+    def __evict(self):
+        while len(self.__archives) > self.size:
+            key, oldest = self.__archives.popitem(last=False)
+            oldest.close()
+
+
+class Rp9Prefetcher:
+    """Loads the manifests and images of rp9 files in background threads and adds the sessions to a pool."""
+
+    def __init__(self, pool, workers=2):
+        self.pool = pool
+        self.__executor = ThreadPoolExecutor(max_workers=workers)
+        self.__futures = {}
+        # done callbacks may run at once in the thread holding the lock
+        self.__lock = threading.RLock()
+
+    def prefetch(self, files):
+        """Queues the files in the given order, queued files which are not in the list anymore are dropped."""
+        keys = set(str(file) for file in files)
+        with self.__lock:
+            for key, future in list(self.__futures.items()):
+                if key not in keys and future.cancel():
+                    # the done callback of a cancelled future has already run
+                    self.__futures.pop(key, None)
+
+            for file in files:
+                key = str(file)
+                if key not in self.__futures and not self.pool.contains(file):
+                    future = self.__executor.submit(self.__load, file)
+                    self.__futures[key] = future
+                    future.add_done_callback(lambda done, key=key: self.__forget(key, done))
+
+    def cancel(self, file):
+        """Drops a queued file, a file already being loaded is added to the pool unless it was opened meanwhile."""
+        with self.__lock:
+            future = self.__futures.get(str(file))
+            if future is not None and future.cancel():
+                self.__futures.pop(str(file), None)
+
+    def shutdown(self):
+        with self.__lock:
+            for future in self.__futures.values():
+                future.cancel()
+            self.__futures.clear()
+        self.__executor.shutdown(wait=True)
+
+    def __load(self, file):
+        with metrics.phase('prefetch'):
+            archive = Rp9Archive(file)
+            try:
+                get_info(archive, True)
+            except Rp9UtilException:
+                return  # reported when the file is opened
+            finally:
+                # the handles reopen the zip file if needed
+                archive.close()
+            self.pool.add(archive)
+
+    def __forget(self, key, future):
+        with self.__lock:
+            if self.__futures.get(key) is future:
+                del self.__futures[key]
+
+
+@contextmanager
+def __session(file):
+    if isinstance(file, Rp9Archive):
+        yield file
+    else:
+        with Rp9Archive(file) as archive:
+            yield archive
 
 
 def get_info(file, load_extras=False):
+    with __session(file) as archive:
+        try:
+            if archive.info is None:
+                stat = archive.stat()
+                with metrics.phase('index_lookup'):
+                    info = __lookup_index(archive.file, stat)
+                if info is None:
+                    with metrics.phase('open_zip'):
+                        zipfile = archive.open()
+                    with metrics.phase('parse_manifest') as phase, zipfile.open('rp9-manifest.xml') as manifest:
+                        info = Rp9Info()
+                        __parse_manifest(ElementTree.parse(manifest).getroot(), info)
+                        __look_for_default_extras(zipfile, info)
+                        phase.add_bytes(zipfile.getinfo('rp9-manifest.xml').file_size)
+                    with metrics.phase('index_store'):
+                        __store_index(archive.file, stat, info)
+                # the extras are read when they are used
+                for extra in info.embedded_help + info.embedded_images:
+                    extra.archive = archive
+                archive.info = info
+
+            if load_extras and not archive.extras_loaded:
+                for helpdoc in archive.info.embedded_help:
+                    helpdoc.text
+                for image in archive.info.embedded_images:
+                    image.image
+                archive.extras_loaded = True
+
+            return archive.info
+
+        except Exception:
+            sys.stderr.write('Could not rp9 file: \'' + str(archive.file) + '\'\n')
+            traceback.print_exc(file=sys.stderr)
+            raise Rp9UtilException(_('This is not a valid rp9 file!'))
+
+
+def __lookup_index(file, stat):
+    global manifest_index
+    if manifest_index is None:
+        return None
+
     try:
-        with ZipFile(str(file)) as zipfile:
-            with zipfile.open('rp9-manifest.xml') as manifest:
-                info = Rp9Info()
-                __parse_manifest(ElementTree.parse(manifest).getroot(), info)
-                __look_for_default_extras(zipfile, info)
-                if load_extras:
-                    __load_help(zipfile, info)
-                    __load_images(zipfile, info)
-                return info
+        entry = manifest_index.lookup(file, stat.st_size, stat.st_mtime_ns)
+    except Exception:
+        sys.stderr.write('Could not read manifest index: \'' + str(manifest_index.file) + '\'\n')
+        traceback.print_exc(file=sys.stderr)
+        manifest_index = None
+        return None
+
+    if entry is None:
+        return None
+
+    info = Rp9Info()
+    for field in INFO_FIELDS:
+        setattr(info, field, entry.fields[field])
+    for media_type, priority, name in entry.media:
+        media = Rp9Media()
+        info.media.append(media)
+        media.type = media_type
+        media.priority = priority
+        media.name = name
+    for priority, name in entry.help:
+        helpdoc = Rp9Help()
+        info.embedded_help.append(helpdoc)
+        helpdoc.priority = priority
+        helpdoc.name = name
+    for priority, name in entry.images:
+        imgdoc = Rp9Image()
+        info.embedded_images.append(imgdoc)
+        imgdoc.priority = priority
+        imgdoc.name = name
+    return info
+
+
+def __store_index(file, stat, info):
+    global manifest_index
+    if manifest_index is None:
+        return
+
+    entry = Rp9IndexEntry()
+    for field in INFO_FIELDS:
+        entry.fields[field] = getattr(info, field)
+    entry.media = [(media.type, media.priority, media.name) for media in info.media]
+    entry.help = [(helpdoc.priority, helpdoc.name) for helpdoc in info.embedded_help]
+    entry.images = [(imgdoc.priority, imgdoc.name) for imgdoc in info.embedded_images]
 
+    try:
+        manifest_index.store(file, stat.st_size, stat.st_mtime_ns, entry)
     except Exception:
-        sys.stderr.write('Could not rp9 file: \'' + str(file) + '\'\n')
+        sys.stderr.write('Could not write manifest index: \'' + str(manifest_index.file) + '\'\n')
         traceback.print_exc(file=sys.stderr)
-        raise Rp9UtilException(_('This is not a valid rp9 file!'))
+        manifest_index = None
 
 
 def __parse_manifest(root, info):
@@ -210,7 +607,7 @@ def __parse_description(description, info):
 
 
 def __parse_media(media, info):
-    children = media.getchildren()
+    children = list(media)
     length = len(children)
     for i in range(length):
         child = children[i]
@@ -264,25 +661,57 @@ def __look_for_default_extras(zipfile, info):
             pass
 
 
-def __load_help(zipfile, info):
-    for doc in info.embedded_help:
-        try:
-            with zipfile.open(doc.name) as text:
-                doc.text = io.TextIOWrapper(io.BytesIO(text.read())).read()
-        except KeyError:
-            sys.stderr.write('Could not find embedded document: \'' + doc.name + '\'\n')
-            traceback.print_exc(file=sys.stderr)
+def read_help(archive, name):
+    try:
+        with metrics.phase('load_help') as phase:
+            zipfile = archive.open()
+            zipinfo = zipfile.getinfo(name)
+            phase.add_bytes(zipinfo.file_size)
+            with zipfile.open(zipinfo) as file, io.TextIOWrapper(file) as text:
+                return text.read()
+    except KeyError:
+        sys.stderr.write('Could not find embedded document: \'' + name + '\'\n')
+        traceback.print_exc(file=sys.stderr)
+        return None
+
 
+def read_image(archive, name):
+    global thumbnail_cache
+    codec = image_codec
+    if codec is None:
+        return None
 
-def __load_images(zipfile, info):
-    for image in info.embedded_images:
+    with metrics.phase('load_images') as phase:
+        zipfile = archive.open()
         try:
-            with zipfile.open(image.name) as file:
-                image.image = QImage()
-                image.image.loadFromData(file.read())
+            zipinfo = zipfile.getinfo(name)
         except KeyError:
-            sys.stderr.write('Could not find embedded image: \'' + image.name + '\'\n')
+            sys.stderr.write('Could not find embedded image: \'' + name + '\'\n')
             traceback.print_exc(file=sys.stderr)
+            return None
+
+        key = None
+        cache = thumbnail_cache
+        if cache is not None:
+            key = cache.key(archive.file, archive.stat(), name, zipinfo.CRC)
+            data = cache.get(key)
+            if data is not None:
+                image = codec.load(data)
+                if image is not None:
+                    return image
+
+        phase.add_bytes(zipinfo.file_size)
+        with zipfile.open(zipinfo) as file:
+            image = codec.thumbnail(file.read(), THUMBNAIL_SIZE)
+
+        if key is not None and image is not None:
+            try:
+                cache.put(key, codec.save(image))
+            except Exception:
+                sys.stderr.write('Could not write thumbnail cache: \'' + str(cache.directory) + '\'\n')
+                traceback.print_exc(file=sys.stderr)
+                thumbnail_cache = None
+        return image
 
 
 def __check_temp_dir(name):
@@ -345,25 +774,230 @@ def __delete_dir(path):
     path.rmdir()
 
 
-def run(rp9_file, config, temporary, override=False):
-    info = get_info(rp9_file)
+def run(rp9_file, config, temporary, override=False, progress=None):
+    with __session(rp9_file) as archive:
+        info = get_info(archive)
+
+        if config.fsuae_command is None or len(config.fsuae_command) == 0:
+            raise Rp9UtilException(_('The FS-UAE command is not configured!'))
+        command = Path(config.fsuae_command)
+        if not command.is_file():
+            raise Rp9UtilException(_('The configured FS-UAE command was not found!'))
+
+        if temporary and config.direct_launch and __is_direct_launchable(archive, info):
+            floppy_list, hd_list, boot_hdfs = __check_media(info, config)
+            rp9_path = Path(os.path.abspath(str(archive.file)))
+            arguments = __config_arguments(info, rp9_path, floppy_list, hd_list, boot_hdfs, True)
+            return Rp9Process(command, None, None, arguments)
+
+        if temporary and config.temp_cache_size > 0:
+            cached = __extract_to_cache(archive, info, config, progress)
+            if cached is not None:
+                config_file, lock_file = cached
+                return Rp9Process(command, config_file, None, lock=lock_file)
+
+        report = Rp9ExtractReport()
+        config_file = __extract_and_write_config(archive, info, config, temporary, override, progress, report)
+        if temporary:
+            lock_file = config_file.parent.joinpath(LOCK_FILE)
+            return Rp9Process(command, config_file, config_file.parent, lock=lock_file)
+        else:
+            return Rp9Process(command, config_file, None, report=report)
 
-    if config.fsuae_command is None or len(config.fsuae_command) == 0:
-        raise Rp9UtilException(_('The FS-UAE command is not configured!'))
-    command = Path(config.fsuae_command)
-    if not command.is_file():
-        raise Rp9UtilException(_('The configured FS-UAE command was not found!'))
 
-    config_file = __extract_and_write_config(rp9_file, info, config, temporary, override)
-    if temporary:
-        return Rp9ProcessWorker(command, config_file, config_file.parent)
-    else:
-        return Rp9ProcessWorker(command, config_file, None)
+def extract(rp9_file, config, override=False, progress=None):
+    with __session(rp9_file) as archive:
+        info = get_info(archive)
+        report = Rp9ExtractReport()
+        __extract_and_write_config(archive, info, config, False, override, progress, report)
+        return report
 
 
-def extract(rp9_file, config, override=False):
-    info = get_info(rp9_file)
-    __extract_and_write_config(rp9_file, info, config, False, override)
+def write_config(rp9_file, config, override=False):
+    with __session(rp9_file) as archive:
+        info = get_info(archive)
+        floppy_list, hd_list, boot_hdfs = __check_media(info, config)
+
+        media_base_dir = __check_rp9_dir(config.fsuae_rp9_dir)
+        config_dir = __check_fsuae_config_dir(config.fsuae_documents_dir)
+        media_name = __media_name(archive.file, info)
+        media_dir = media_base_dir.joinpath(media_name)
+        if not media_dir.is_dir():
+            raise Rp9UtilException(_('This rp9 file is not extracted!'))
+
+        config_file = config_dir.joinpath(media_name + '.fs-uae')
+        if config_file.exists() and not override:
+            raise Rp9UtilException(_('This rp9 configuration already exists!'))
+
+        __write_config(config_file, info, media_dir, floppy_list, hd_list, boot_hdfs)
+        return config_file
+
+
+def extracted_titles(config):
+    """Returns the directories of the extracted titles, they contain a copy of the manifest."""
+    media_base_dir = __check_rp9_dir(config.fsuae_rp9_dir)
+    return sorted(path for path in media_base_dir.iterdir() if path.joinpath('rp9-manifest.xml').is_file())
+
+
+def regenerate_config(media_dir, config):
+    """Writes the configuration of an extracted title from its saved manifest, the media files are not touched."""
+    media_dir = Path(media_dir)
+    config_dir = __check_fsuae_config_dir(config.fsuae_documents_dir)
+
+    info = Rp9Info()
+    with metrics.phase('parse_manifest'):
+        __parse_manifest(ElementTree.parse(str(media_dir.joinpath('rp9-manifest.xml'))).getroot(), info)
+    floppy_list, hd_list, boot_hdfs = __check_media(info, config)
+
+    config_file = config_dir.joinpath(media_dir.name + '.fs-uae')
+    __write_config(config_file, info, media_dir, floppy_list, hd_list, boot_hdfs)
+    return config_file
+
+
+def regenerate_configs(config, progress=None, threads=4):
+    """Rewrites the configurations of all extracted titles in parallel.
+
+    Returns a (media dir, config file, error message) tuple per title, the config file is None if it failed.
+    """
+    media_dirs = extracted_titles(config)
+    __check_fsuae_config_dir(config.fsuae_documents_dir)
+    if progress is not None:
+        progress.start(len(media_dirs))
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        futures = dict((executor.submit(regenerate_config, media_dir, config), media_dir) for media_dir in media_dirs)
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=0.1)
+                for future in done:
+                    media_dir = futures[future]
+                    try:
+                        results.append((media_dir, future.result(), None))
+                    except Rp9UtilException as ex:
+                        results.append((media_dir, None, str(ex)))
+                    except Exception as ex:
+                        sys.stderr.write('Could not write configuration: \'' + str(media_dir) + '\'\n')
+                        traceback.print_exc(file=sys.stderr)
+                        results.append((media_dir, None, str(ex)))
+                    if progress is not None:
+                        progress.member = media_dir.name
+                        progress.advance(1)
+                if progress is not None:
+                    progress.update()
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    return sorted(results, key=lambda result: result[0])
+
+
+def optimize(rp9_file, level=None, max_preview=OPTIMIZE_PREVIEW_SIZE, progress=None):
+    """Rewrites an rp9 file with the manifest and the extras first, the media stored or deflated with the level.
+
+    The manifest is copied byte for byte. Returns the sizes of the file before and after.
+    """
+    if progress is None:
+        progress = Rp9Progress()
+
+    rp9_file = Path(rp9_file)
+    old_size = rp9_file.stat().st_size
+    temp = rp9_file.with_name('.' + rp9_file.name + '.' + str(os.getpid()) + '.tmp')
+    try:
+        with ZipFile(str(rp9_file)) as source:
+            try:
+                manifest = source.read('rp9-manifest.xml')
+                info = Rp9Info()
+                __parse_manifest(ElementTree.fromstring(manifest), info)
+                __look_for_default_extras(source, info)
+            except Exception:
+                sys.stderr.write('Could not rp9 file: \'' + str(rp9_file) + '\'\n')
+                traceback.print_exc(file=sys.stderr)
+                raise Rp9UtilException(_('This is not a valid rp9 file!'))
+
+            extras = [extra.name for extra in info.embedded_help + info.embedded_images]
+            media = [media.name for media in info.media]
+            order = {'rp9-manifest.xml': 0}
+            for name in extras:
+                order.setdefault(name, 1)
+            for name in media:
+                order.setdefault(name, 2)
+            # the other members keep their order behind the media
+            zipinfos = sorted(source.infolist(), key=lambda zipinfo: order.get(zipinfo.filename, 3))
+            images = set(image.name for image in info.embedded_images)
+
+            progress.start(sum(zipinfo.file_size for zipinfo in zipinfos))
+            with metrics.phase('optimize') as phase, ZipFile(str(temp), 'w') as target:
+                target.comment = source.comment
+                for zipinfo in zipinfos:
+                    progress.start_member(zipinfo.filename, zipinfo.file_size)
+                    kind = order.get(zipinfo.filename, 3)
+                    if zipinfo.filename in images:
+                        __optimize_image(source, zipinfo, target, max_preview)
+                        progress.advance(zipinfo.file_size)
+                    elif kind == 0:
+                        # read first and small, stored to be parsed without inflating
+                        target.writestr(__optimize_zipinfo(zipinfo, ZIP_STORED), manifest)
+                        progress.advance(zipinfo.file_size)
+                    elif kind == 2:
+                        __optimize_copy(source, zipinfo, target,
+                                        __optimize_zipinfo(zipinfo, ZIP_STORED if level is None else ZIP_DEFLATED,
+                                                           level), progress)
+                    else:
+                        __optimize_copy(source, zipinfo, target, __optimize_zipinfo(zipinfo, zipinfo.compress_type),
+                                        progress)
+                    phase.add_bytes(zipinfo.file_size)
+
+        os.chmod(str(temp), rp9_file.stat().st_mode & 0o7777)
+        os.replace(str(temp), str(rp9_file))
+
+    except BaseException:
+        # the original file is only replaced by a complete one
+        if temp.exists():
+            temp.unlink()
+        raise
+
+    return old_size, rp9_file.stat().st_size
+
+
+def __optimize_zipinfo(zipinfo, compress_type, level=None):
+    result = ZipInfo(zipinfo.filename, zipinfo.date_time)
+    result.compress_type = compress_type
+    result.comment = zipinfo.comment
+    result.external_attr = zipinfo.external_attr
+    result.create_system = zipinfo.create_system
+    # known before writing, members larger than 2 GiB get the zip64 header
+    result.file_size = zipinfo.file_size
+    if level is not None:
+        # ZipFile.open() only applies the level of the archive to members given by name
+        result._compresslevel = level
+    return result
+
+
+def __optimize_copy(source, zipinfo, target, target_info, progress):
+    with source.open(zipinfo) as reader, target.open(target_info, 'w') as writer:
+        while True:
+            chunk = reader.read(COPY_BUFFER_SIZE)
+            if not chunk:
+                break
+            writer.write(chunk)
+            progress.advance(len(chunk))
+
+
+def __optimize_image(source, zipinfo, target, max_preview):
+    data = source.read(zipinfo)
+    image_format = OPTIMIZE_IMAGE_FORMATS.get(os.path.splitext(zipinfo.filename)[1].lower())
+    codec = image_codec
+    if codec is not None and image_format is not None and max_preview:
+        scaled = codec.downscale(data, max_preview, image_format)
+        if scaled is not None and len(scaled) < len(data):
+            data = scaled
+    # the images are compressed already
+    target_info = __optimize_zipinfo(zipinfo, ZIP_STORED)
+    target_info.file_size = len(data)
+    target.writestr(target_info, data)
 
 
 def is_already_extracted(rp9_file, config):
@@ -376,16 +1010,28 @@ def is_already_extracted(rp9_file, config):
     return media_dir.is_dir() or config_file.exists()
 
 
-def __extract_and_write_config(rp9_file, info, config, temporary, override):
+def __is_direct_launchable(archive, info):
+    # FS-UAE reads disk images inside of zip archives (path/to/file.rp9/disk.adf), but hard disk images must be
+    # writable files
+    if info.media is None or len(info.media) == 0:
+        return False
+
+    zipfile = archive.open()
+    for media in info.media:
+        if media.type != 'floppy':
+            return False
+        if not media.name.lower().endswith(DIRECT_LAUNCH_EXTENSIONS):
+            return False
+        try:
+            zipinfo = zipfile.getinfo(media.name)
+        except KeyError:
+            return False
+        if zipinfo.compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+            return False
+    return True
 
-    # pre check
-    if temporary:
-        media_base_dir = __check_temp_dir(config.temp_dir)
-        config_dir = media_base_dir
-    else:
-        media_base_dir = __check_rp9_dir(config.fsuae_rp9_dir)
-        config_dir = __check_fsuae_config_dir(config.fsuae_documents_dir)
 
+def __check_media(info, config):
     if info.media is None or len(info.media) == 0:
         raise Rp9UtilException(_('The rp9 file as no media files!'))
 
@@ -412,7 +1058,10 @@ def __extract_and_write_config(rp9_file, info, config, temporary, override):
             info.configuration_hdf_boot not in boot_hdfs:
         raise Rp9UtilException(_('The rp9 file contains an unsupported boot harddisk!'))
 
-    # extract media
+    return floppy_list, hd_list, boot_hdfs
+
+
+def __media_name(rp9_file, info):
     media_name = None
     if info.description_title is None or len(info.description_title) == 0:
         name = rp9_file.name
@@ -420,31 +1069,70 @@ def __extract_and_write_config(rp9_file, info, config, temporary, override):
             media_name = name[:-4]
     else:
         media_name = info.description_title
+    return media_name
 
-    # media_dir = None
-    if temporary:
-        media_dir = media_base_dir.joinpath('rp9unpacker_' + media_name)
-    else:
-        media_dir = media_base_dir.joinpath(media_name)
 
-    if media_dir.is_file():
-        raise Rp9UtilException(_('Couldn\'t extract files! Directory already exists as file.'))
+def __extract_and_write_config(archive, info, config, temporary, override, progress=None, report=None):
 
-    if media_dir.is_dir():
-        if temporary or override:
-            __delete_dir(media_dir)
+    with metrics.phase('check_dirs'):
+        # pre check
+        if temporary:
+            media_base_dir = __check_temp_dir(config.temp_dir)
+            config_dir = media_base_dir
         else:
-            raise Rp9UtilException(_('This rp9 file is already extracted!'))
+            media_base_dir = __check_rp9_dir(config.fsuae_rp9_dir)
+            config_dir = __check_fsuae_config_dir(config.fsuae_documents_dir)
+
+        floppy_list, hd_list, boot_hdfs = __check_media(info, config)
 
-    media_dir.mkdir()
+        # extract media
+        media_name = __media_name(archive.file, info)
 
-    with ZipFile(str(rp9_file)) as zipfile:
-        for media in info.media:
-            media_file = media_dir.joinpath(media.name)
-            if not media_file.is_file() and not media_file.is_dir() and not media_file.is_symlink():
-                zipfile.extract(media.name, media_dir)
-        if not temporary:
-            zipfile.extract('rp9-manifest.xml', media_dir)
+        # media_dir = None
+        if temporary:
+            media_dir = media_base_dir.joinpath('rp9unpacker_' + media_name)
+        else:
+            media_dir = media_base_dir.joinpath(media_name)
+
+        if media_dir.is_file():
+            raise Rp9UtilException(_('Couldn\'t extract files! Directory already exists as file.'))
+
+    if report is None:
+        report = Rp9ExtractReport()
+
+    if media_dir.is_dir() and override and not temporary and config.incremental_extract:
+        # only rewrite what changed in the archive
+        with metrics.phase('sync_media'):
+            __sync_media(archive, info, media_dir, progress, __media_store(config), report)
+        for name in report.modified:
+            sys.stderr.write('Keeping modified file: \'' + str(media_dir.joinpath(name)) + '\'\n')
+    else:
+        if media_dir.is_dir():
+            if temporary:
+                if ExtractionCache.is_locked(media_dir):
+                    raise Rp9UtilException(_('This rp9 file is already running from the temp directory!'))
+                cleanup.queue.remove(media_dir)
+            elif override:
+                with metrics.phase('delete_dir'):
+                    __delete_dir(media_dir)
+            else:
+                raise Rp9UtilException(_('This rp9 file is already extracted!'))
+
+        media_dir.mkdir()
+        if temporary:
+            # keeps the janitor of other instances away while this one uses the directory
+            ExtractionCache.lock(media_dir)
+
+        try:
+            zipinfos = __extract_media(archive.open(), info, media_dir, temporary, progress, __media_store(config),
+                                       config.extract_threads)
+            if not temporary:
+                write_extraction_state(media_dir, archive.file, archive.stat(), zipinfos)
+            report.added.extend(zipinfo.filename for zipinfo in zipinfos)
+        except BaseException:
+            # remove the partial output
+            __delete_dir(media_dir)
+            raise
 
     # write config
     if temporary:
@@ -454,100 +1142,374 @@ def __extract_and_write_config(rp9_file, info, config, temporary, override):
         if config_file.exists() and not override:
             raise Rp9UtilException(_('This rp9 configuration already exists!'))
 
-    with open(str(config_file), 'w', encoding='utf-8') as config:
-        config.write('# FS-UAE configuration saved by rp9UnpAckEr\n\n')
-        config.write('[fs-uae]\n')
+    __write_config(config_file, info, media_dir, floppy_list, hd_list, boot_hdfs)
+    return config_file
 
-        # write mode
-        models = {
-            'a-500': 'A500',
-            'a-500plus': 'A500+',
-            'a-600': 'A600',
-            'a-1000': 'A1000',
-            'a-1200': 'A1200',
-            'a-2000': 'A500',
-            'a-3000': 'A3000',
-            'a-4000': 'A4000/040'
-        }
-
-        if info.configuration_system not in models:
-            print('Unknown amiga system: ' + info.configuration_system + ' Using default.')
-
-        config.write('amiga_model = ')
-        config.write(models.get(info.configuration_system, 'a-500'))
-        config.write('\n')
-
-        # write memory config
-        if info.configuration_chip_ram is not None and info.configuration_chip_ram > 0:
-            config.write('chip_memory = ')
-            config.write(str(info.configuration_chip_ram))
-            config.write('\n')
 
-        if info.configuration_fast_ram is not None and info.configuration_fast_ram > 0:
-            config.write('fast_memory = ')
-            config.write(str(info.configuration_fast_ram))
-            config.write('\n')
+def __extract_to_cache(archive, info, config, progress):
+    temp_dir = __check_temp_dir(config.temp_dir)
+    floppy_list, hd_list, boot_hdfs = __check_media(info, config)
 
-        if info.configuration_z3_ram is not None and info.configuration_z3_ram > 0:
-            config.write('zorro_iii_memory = ')
-            config.write(str(info.configuration_z3_ram))
-            config.write('\n')
+    cache = ExtractionCache(temp_dir.joinpath('rp9unpacker-cache'), config.temp_cache_size * 1024 * 1024)
+    entry = cache.entry_dir(archive.file)
+    if cache.is_locked(entry):
+        # a running FS-UAE uses this extraction
+        return None
 
-        # write cpu config
-        if info.configuration_cpu is not None:
-            config.write('cpu = ')
-            config.write(info.configuration_cpu)
-            config.write('\n')
+    zipfile = archive.open()
+    zipinfos, types = __media_zipinfos(zipfile, info, True)
+    if cache.is_valid(entry, archive.file, archive.stat(), zipinfos):
+        cache.touch(entry)
+    else:
+        if entry.is_dir():
+            __delete_dir(entry)
+        if not cache.reserve(sum(zipinfo.file_size for zipinfo in zipinfos)):
+            return None
 
-        # write harddisks
-        offset = 0
-        if info.configuration_hdf_boot is not None and len(info.configuration_hdf_boot) > 0:
-            config.write('hard_drive_0 = ')
-            config.write(boot_hdfs.get(info.configuration_hdf_boot))
-            config.write('\n')
-            offset = 1
+        entry.mkdir()
+        try:
+            __extract_media(zipfile, info, entry, True, progress, __media_store(config), config.extract_threads)
+            write_extraction_state(entry, archive.file, archive.stat(), zipinfos)
+        except BaseException:
+            # remove the partial output
+            __delete_dir(entry)
+            raise
+
+    config_file = entry.joinpath(__media_name(archive.file, info) + '.fs-uae')
+    __write_config(config_file, info, entry, floppy_list, hd_list, boot_hdfs)
+    return config_file, cache.lock(entry)
+
+
+def __media_store(config):
+    if config.media_store_dir is None or len(config.media_store_dir) == 0:
+        return None
+    return MediaStore(config.media_store_dir)
+
+
+def __extract_media(zipfile, info, media_dir, temporary, progress, store=None, threads=1):
+    if progress is None:
+        progress = Rp9Progress()
+
+    zipinfos, types = __media_zipinfos(zipfile, info, temporary)
+    progress.start(sum(zipinfo.file_size for zipinfo in zipinfos))
+
+    tasks = []
+    for zipinfo in zipinfos:
+        media_file = __member_path(media_dir, zipinfo.filename)
+        if not media_file.is_file() and not media_file.is_dir() and not media_file.is_symlink() and \
+                media_file not in [task[1] for task in tasks]:
+            tasks.append((zipinfo, media_file, types.get(zipinfo.filename)))
+
+    with metrics.phase('extract_media') as phase:
+        if threads is None or threads < 2 or len(tasks) < 2:
+            for zipinfo, media_file, media_type in tasks:
+                __extract_task(zipfile, zipinfo, media_file, media_type, progress, store)
+        else:
+            __extract_parallel(zipfile.filename, tasks, progress, store, threads)
+        phase.add_bytes(sum(task[0].file_size for task in tasks))
+
+    return zipinfos
+
+
+def __sync_media(archive, info, media_dir, progress, store, report):
+    if progress is None:
+        progress = Rp9Progress()
+
+    zipfile = archive.open()
+    zipinfos, types = __media_zipinfos(zipfile, info, False)
+    state = read_extraction_state(media_dir)
+    members = state.get('members', {}) if state is not None else {}
+
+    tasks = []
+    keep = {}
+    for zipinfo in zipinfos:
+        name = zipinfo.filename
+        media_file = __member_path(media_dir, name)
+        member = members.get(name)
+        if media_file.is_dir():
+            raise Rp9UtilException(_('Couldn\'t extract files! File already exists as directory.'))
+
+        if not media_file.exists():
+            report.added.append(name)
+            tasks.append((zipinfo, media_file))
+            continue
+
+        stat = media_file.stat()
+        unmodified = member is not None and member.get('size') == stat.st_size and \
+            member.get('mtime') == stat.st_mtime_ns
+        if unmodified and member.get('crc') == zipinfo.CRC:
+            # untouched since the last extraction of the same content
+            report.unchanged.append(name)
+        elif stat.st_size == zipinfo.file_size and __file_crc(media_file) == zipinfo.CRC:
+            report.unchanged.append(name)
+        elif unmodified or state is None or name == 'rp9-manifest.xml':
+            # the file is still the one extracted last time and the archive has changed, libraries extracted
+            # without a state file can't tell a changed file from an updated archive, there the archive wins
+            report.updated.append(name)
+            tasks.append((zipinfo, media_file))
+        else:
+            # changed outside of rp9UnpAckEr, for example a save disk written by FS-UAE
+            report.modified.append(name)
+            keep[name] = member if member is not None else {'crc': None, 'size': None, 'mtime': None}
 
-        length = len(hd_list)
-        for i in range(length):
-            config.write('hard_drive_' + str(i + offset))
+    progress.start(sum(task[0].file_size for task in tasks))
+    done = set()
+    try:
+        with metrics.phase('extract_media') as phase:
+            for zipinfo, media_file in tasks:
+                # written next to the old file and moved over it when complete, the old file may be shared with
+                # the media store, never write into it
+                part_file = media_file.with_name(media_file.name + '.rp9unpacker-part')
+                try:
+                    __extract_task(zipfile, zipinfo, part_file, types.get(zipinfo.filename), progress, store)
+                    os.replace(str(part_file), str(media_file))
+                except BaseException:
+                    if part_file.exists():
+                        part_file.unlink()
+                    raise
+                done.add(zipinfo.filename)
+                phase.add_bytes(zipinfo.file_size)
+
+    finally:
+        # after a cancel the members not written yet keep the state of the last extraction
+        pending = set(task[0].filename for task in tasks) - done
+        written = []
+        for zipinfo in zipinfos:
+            name = zipinfo.filename
+            if name not in pending or name in keep:
+                written.append(zipinfo)
+            elif name in members:
+                keep[name] = members[name]
+                written.append(zipinfo)
+        write_extraction_state(media_dir, archive.file, archive.stat(), written, keep)
+
+
+def __file_crc(path):
+    crc = 0
+    with open(str(path), 'rb') as file:
+        while True:
+            chunk = file.read(COPY_BUFFER_SIZE)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return crc & 0xffffffff
+
+
+def __extract_task(zipfile, zipinfo, media_file, media_type, progress, store):
+    if store is not None and media_type is not None:
+        # floppy images are not written by FS-UAE, only they may share the inode with the store
+        __extract_stored_member(zipfile, zipinfo, media_file, progress, store, media_type == 'floppy',
+                                media_type == 'harddrive')
+    else:
+        __extract_member(zipfile, zipinfo, media_file, progress, sparse=media_type == 'harddrive')
+
+
+def __extract_parallel(rp9_file, tasks, progress, store, threads):
+    # every thread reads the archive through its own file handle, zlib releases the GIL while inflating
+    lock = threading.Lock()
+    abort = threading.Event()
+    local = threading.local()
+    handles = []
+
+    def extract(zipinfo, media_file, media_type):
+        zipfile = getattr(local, 'zipfile', None)
+        if zipfile is None:
+            zipfile = ZipFile(rp9_file)
+            local.zipfile = zipfile
+            with lock:
+                handles.append(zipfile)
+        __extract_task(zipfile, zipinfo, media_file, media_type, Rp9WorkerProgress(progress, lock, abort), store)
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(threads, len(tasks))) as executor:
+            futures = [executor.submit(extract, *task) for task in tasks]
+            try:
+                pending = futures
+                while pending:
+                    done, pending = wait(pending, timeout=0.1)
+                    for future in done:
+                        future.result()
+                    progress.update()
+            except BaseException:
+                abort.set()
+                raise
+    finally:
+        for zipfile in handles:
+            zipfile.close()
+
+
+def __media_zipinfos(zipfile, info, temporary):
+    members = []
+    types = {}
+    for media in info.media:
+        if media.name not in members:
+            members.append(media.name)
+            types[media.name] = media.type
+    if not temporary:
+        members.append('rp9-manifest.xml')
+
+    zipinfos = []
+    for name in members:
+        try:
+            zipinfos.append(zipfile.getinfo(name))
+        except KeyError:
+            raise Rp9UtilException(_('The rp9 file doesn\'t contain the media file: ') + name)
+    return zipinfos, types
+
+
+def __member_path(media_dir, name):
+    try:
+        return member_path(media_dir, name)
+    except ValueError:
+        raise Rp9UtilException(_('The rp9 file contains an invalid file name!'))
+
+
+def __extract_stored_member(zipfile, zipinfo, target, progress, store, hardlink, sparse=False):
+    progress.start_member(zipinfo.filename, zipinfo.file_size)
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    if store.link(zipinfo.CRC, zipinfo.file_size, target, hardlink):
+        progress.advance(zipinfo.file_size)
+    else:
+        digest = __extract_member(zipfile, zipinfo, target, progress, hashlib.sha256(), sparse)
+        store.add(zipinfo.CRC, zipinfo.file_size, target, digest.hexdigest(), hardlink)
+
+
+def __extract_member(zipfile, zipinfo, target, progress, digest=None, sparse=False):
+    progress.start_member(zipinfo.filename, zipinfo.file_size)
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    with zipfile.open(zipinfo) as source, open(str(target), 'wb') as out:
+        while True:
+            chunk = source.read(COPY_BUFFER_SIZE)
+            if not chunk:
+                break
+            if sparse:
+                __write_sparse(out, chunk)
+            else:
+                out.write(chunk)
+            if digest is not None:
+                digest.update(chunk)
+            progress.advance(len(chunk))
+        if sparse:
+            # a hole at the end only moved the position, the size is set here
+            out.truncate()
+
+    if sparse:
+        # the holes must read back as the zeros of the archive
+        with metrics.phase('verify_sparse'):
+            if __file_crc(target) != zipinfo.CRC:
+                raise Rp9UtilException(_('The extracted hard disk image is damaged: ') + zipinfo.filename)
+    return digest
+
+
+def __write_sparse(out, chunk):
+    start = 0
+    for pos in range(0, len(chunk), SPARSE_BLOCK_SIZE):
+        block = chunk[pos:pos + SPARSE_BLOCK_SIZE]
+        if block == ZERO_BLOCK or (len(block) < SPARSE_BLOCK_SIZE and block.count(0) == len(block)):
+            if start < pos:
+                out.write(chunk[start:pos])
+            out.seek(len(block), os.SEEK_CUR)
+            start = pos + len(block)
+    if start == 0:
+        out.write(chunk)
+    elif start < len(chunk):
+        out.write(chunk[start:])
+
+
+def __write_config(config_file, info, media_dir, floppy_list, hd_list, boot_hdfs):
+    with metrics.phase('write_config'), open(str(config_file), 'w', encoding='utf-8') as config:
+        config.write('# FS-UAE configuration saved by rp9UnpAckEr\n\n')
+        config.write('[fs-uae]\n')
+        for key, value in __config_options(info, media_dir, floppy_list, hd_list, boot_hdfs):
+            config.write(key)
             config.write(' = ')
-            config.write(str(media_dir.joinpath(hd_list[i].name)))
+            config.write(value)
             config.write('\n')
 
-        # write floppies
-        floppy_count = 1
-        if info.configuration_floppy_count > 1:
-            floppy_count = info.configuration_floppy_count
 
-        length = len(floppy_list)
-        if length > floppy_count:
-            length = floppy_count
+def __config_arguments(info, media_dir, floppy_list, hd_list, boot_hdfs, in_archive=False):
+    return ['--' + key + '=' + value for key, value in
+            __config_options(info, media_dir, floppy_list, hd_list, boot_hdfs, in_archive)]
+
+
+def __media_path(media_dir, name, in_archive):
+    # FS-UAE reads the members of an archive by their names, extracted members are where __member_path put them
+    if in_archive:
+        return str(media_dir.joinpath(name))
+    return str(__member_path(media_dir, name))
+
+
+def __config_options(info, media_dir, floppy_list, hd_list, boot_hdfs, in_archive=False):
+    options = []
+
+    # write mode
+    models = {
+        'a-500': 'A500',
+        'a-500plus': 'A500+',
+        'a-600': 'A600',
+        'a-1000': 'A1000',
+        'a-1200': 'A1200',
+        'a-2000': 'A500',
+        'a-3000': 'A3000',
+        'a-4000': 'A4000/040'
+    }
+
+    if info.configuration_system not in models:
+        print('Unknown amiga system: ' + info.configuration_system + ' Using default.')
+
+    options.append(('amiga_model', models.get(info.configuration_system, 'a-500')))
+
+    # write memory config
+    if info.configuration_chip_ram is not None and info.configuration_chip_ram > 0:
+        options.append(('chip_memory', str(info.configuration_chip_ram)))
+
+    if info.configuration_fast_ram is not None and info.configuration_fast_ram > 0:
+        options.append(('fast_memory', str(info.configuration_fast_ram)))
+
+    if info.configuration_z3_ram is not None and info.configuration_z3_ram > 0:
+        options.append(('zorro_iii_memory', str(info.configuration_z3_ram)))
+
+    # write cpu config
+    if info.configuration_cpu is not None:
+        options.append(('cpu', info.configuration_cpu))
+
+    # write harddisks
+    offset = 0
+    if info.configuration_hdf_boot is not None and len(info.configuration_hdf_boot) > 0:
+        options.append(('hard_drive_0', boot_hdfs.get(info.configuration_hdf_boot)))
+        offset = 1
+
+    length = len(hd_list)
+    for i in range(length):
+        options.append(('hard_drive_' + str(i + offset), __media_path(media_dir, hd_list[i].name, in_archive)))
+
+    # write floppies
+    floppy_count = 1
+    if info.configuration_floppy_count > 1:
+        floppy_count = info.configuration_floppy_count
+
+    length = len(floppy_list)
+    if length > floppy_count:
+        length = floppy_count
+    for i in range(length):
+        options.append(('floppy_drive_' + str(i), __media_path(media_dir, floppy_list[i].name, in_archive)))
+        if info.configuration_silent_drives:
+            options.append(('floppy_drive_' + str(i) + '_sounds', 'off'))
+
+    options.append(('floppy_drive_count', str(floppy_count)))
+    if info.configuration_turbo_floppy:
+        options.append(('floppy_drive_speed', '800'))
+    options.append(('floppy_drive_volume_empty', '0'))
+
+    length = len(floppy_list)
+    if length > 1:
         for i in range(length):
-            config.write('floppy_drive_' + str(i))
-            config.write(' = ')
-            config.write(str(media_dir.joinpath(floppy_list[i].name)))
-            config.write('\n')
-            if info.configuration_silent_drives:
-                config.write('floppy_drive_' + str(i))
-                config.write('_sounds = off\n')
-
-        config.write('floppy_drive_count = ')
-        config.write(str(floppy_count))
-        config.write('\n')
-        if info.configuration_turbo_floppy:
-            config.write('floppy_drive_speed = 800\n')
-        config.write('floppy_drive_volume_empty = 0\n')
-
-        length = len(floppy_list)
-        if length > 1:
-            for i in range(length):
-                config.write('floppy_image_' + str(i))
-                config.write(' = ')
-                config.write(str(media_dir.joinpath(floppy_list[i].name)))
-                config.write('\n')
-
-        # write misc stuff
-        if info.configuration_jit:
-            config.write('jit_compiler = 1\n')
+            options.append(('floppy_image_' + str(i), __media_path(media_dir, floppy_list[i].name, in_archive)))
 
-    return config_file
+    # write misc stuff
+    if info.configuration_jit:
+        options.append(('jit_compiler', '1'))
+
+    return options